@@ -0,0 +1,79 @@
+###render memory regression benchmark###
+#renders the kda and matchup plots many times and fails when the
+#peak resident memory keeps growing, run with python bench_render.py
+########################################
+
+import resource
+import random
+import time
+import final_project
+
+#renders of each plot
+RENDERS = 10000
+#renders of each plot before the baseline is taken, fills the template and font caches
+WARMUP = 200
+#allowed growth of the peak resident memory after warmup, in KB
+MAXRSS_GROWTH_KB = 20 * 1024
+
+def maxrss_kb():
+    ''' peak resident memory of this process
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    int
+        ru_maxrss in KB, as Linux reports it
+    '''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def render_both(rng):
+    ''' render one kda plot and one matchup plot from random data
+
+    Parameters
+    ----------
+    rng: random.Random
+        source of the plot data
+
+    Returns
+    -------
+    N/A
+    '''
+    match_ct = rng.randint(1, 20)
+    win_list = [rng.choice(["Won", "Lost"]) for _ in range(match_ct)]
+    k_list = [rng.randint(0, 30) for _ in range(match_ct)]
+    d_list = [rng.randint(0, 30) for _ in range(match_ct)]
+    a_list = [rng.randint(0, 40) for _ in range(match_ct)]
+    final_project.draw_kda_win(win_list, k_list, d_list, a_list)
+    name_list = [f"hero {rng.randint(1, 130)}" for _ in range(6)]
+    in_rate_list = [rng.random() if rng.random() > 0.1 else "NULL" for _ in range(6)]
+    final_project.draw_matchup(name_list, in_rate_list)
+
+def main():
+    ''' run the benchmark and check the memory growth
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    N/A
+    '''
+    rng = random.Random(0)
+    for _ in range(WARMUP):
+        render_both(rng)
+    baseline = maxrss_kb()
+    start = time.perf_counter()
+    for _ in range(RENDERS):
+        render_both(rng)
+    elapsed = time.perf_counter() - start
+    growth = maxrss_kb() - baseline
+    print(f"{RENDERS} renders of each plot in {elapsed:.1f}s, {elapsed / RENDERS * 1000:.2f}ms per pair")
+    print(f"peak resident memory grew {growth / 1024:.1f}MB after warmup, allowed {MAXRSS_GROWTH_KB / 1024:.0f}MB")
+    assert growth < MAXRSS_GROWTH_KB, f"rendering grew peak resident memory by {growth / 1024:.1f}MB"
+
+if __name__ == "__main__":
+    main()
@@ -3,23 +3,209 @@ import sys
 sys.path.append('/usr/local/lib/python3.8/site-packages/')
 ####################
 
-from flask import Flask, render_template, request
+from flask import Flask, render_template, request, jsonify, make_response, url_for, abort
 from bs4 import BeautifulSoup
 import numpy as np
-import matplotlib
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from matplotlib.ticker import MaxNLocator
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import urlparse
 import json
 import secrets # file that contains your API key
 import time
+import math
+import io
+import hashlib
 import sqlite3
-
-matplotlib.use('Agg')
+import os
+import threading
+import atexit
+import fnmatch
+import queue
+import asyncio
+import difflib
+import gzip
+import codecs
+import itertools
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
 
 #name of the cache
 CACHE_FILENAME = "cache.json"
+#changed cache entries are appended here between full rewrites of the cache file
+CACHE_JOURNAL_FILENAME = "cache_journal.json"
+#seconds between background flushes of changed cache entries
+CACHE_FLUSH_INTERVAL = 5
+#rewrite the whole cache file once the journal holds this many entries
+CACHE_COMPACT_THRESHOLD = 200
+#"json" keeps the cache in CACHE_FILENAME, "sqlite" keeps one row per entry in CACHE_DB_FILENAME
+CACHE_BACKEND = "json"
+CACHE_DB_FILENAME = "cache.sqlite"
+#seconds an entry stays fresh, first matching key pattern wins, unmatched keys never expire
+CACHE_TTL = [
+    ("players/*/matches_*", 5*60),
+    ("search_*", 10*60),
+    ("heroes/*/matchups_*", 24*60*60),
+    ("ProPlayers_*", 24*60*60),
+    ("active_teams_*", 24*60*60),
+    ("constants/heroes_*", 7*24*60*60),
+    ("heroes_*", 7*24*60*60),
+]
+#most entries kept, the least recently used ones are evicted first
+CACHE_MAX_ENTRIES = 5000
+#entries serializing to at least this many bytes are kept compressed in CACHE_BLOB_DIR,
+#named by the hash of their content, the cache file or table only holds a reference
+CACHE_BLOB_THRESHOLD = 16*1024
+CACHE_BLOB_DIR = "cache_blobs"
+#"zstd" when the zstandard package is installed, otherwise "gzip"
+CACHE_BLOB_CODEC = "zstd"
+#unreferenced blobs younger than this many seconds are kept, another process may be about to use them
+CACHE_BLOB_GRACE = 10*60
+
+#in-process cache in LRU order, loaded once by load_cache()
+CACHE = None
+#time each cached entry was stored
+CACHE_TIMES = {}
+#entries changed since the last flush, (value, stored_at) or None when removed
+CACHE_DIRTY = {}
+#time of the last hit of entries read since the last flush, kept for the sqlite backend's LRU trim
+CACHE_ACCESSED = {}
+CACHE_STATS = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0, "blob_reads": 0}
+#cache key -> {"__blob__": file name} of entries whose current value is in the blob store
+CACHE_BLOBS = {}
+#number of entries currently in the journal file
+CACHE_JOURNAL_CT = 0
+CACHE_LOCK = threading.RLock()
+#serializes flushes, held while writing to disk so CACHE_LOCK stays short
+CACHE_FLUSH_LOCK = threading.Lock()
+CACHE_FLUSHER = None
+#idle connections to CACHE_DB_FILENAME, borrowed through cache_db()
+CACHE_DB_POOL = queue.LifoQueue()
+#set once the cache table has been created by this process
+CACHE_DB_READY = False
+
+#(connect, read) timeouts in seconds for upstream requests
+HTTP_TIMEOUT = (5, 30)
+#retries on connection errors, 429 and 5xx, waiting HTTP_BACKOFF * 2**n seconds between them
+HTTP_RETRIES = 4
+HTTP_BACKOFF = 0.5
+#keep-alive connections kept per host
+HTTP_POOL_SIZE = 16
+#hero pages scraped at once by get_hero_detail, 1 fetches them one by one
+HERO_FETCH_WORKERS = 8
+#hero matchup lists in flight at once for Heroes_helper
+MATCHUP_FETCH_WORKERS = 4
+#token bucket per host: (requests per second, burst size)
+RATE_LIMITS = {
+    "api.opendota.com": (1, 5),
+    "www.dota2.com": (10, HERO_FETCH_WORKERS * 2),
+    "liquipedia.net": (0.5, 2),
+}
+#directory of downloaded payloads kept on disk, the cache only points to them
+PAYLOAD_DIR = "payloads"
+#bytes read from the network or a payload file at a time
+STREAM_CHUNK_SIZE = 64*1024
+#ProPlayers rows inserted per batch while the download is parsed
+PROPLAYERS_BATCH = 500
+#shared session, created by get_session()
+HTTP_SESSION = None
+HTTP_LOCK = threading.Lock()
+#host -> [tokens, last refill time]
+RATE_BUCKETS = {}
+RATE_LOCK = threading.Lock()
+#event loop thread the OpenDota fetches run on, started by fetch_loop()
+FETCH_LOOP = None
+FETCH_LOOP_LOCK = threading.Lock()
+#aiohttp session of the fetch loop, False when aiohttp is not installed
+FETCH_SESSION = None
+#cache key -> task of the upstream fetch in flight, only touched on the fetch loop
+INFLIGHT = {}
+FETCH_STATS = {"fetches": 0, "coalesced": 0}
+#name of the database
+DB_FILENAME = "Dota2_api.sqlite"
+#idle connections kept in each pool, extra ones are closed when returned
+DB_POOL_SIZE = 8
+#prepared statements cached per connection
+DB_STATEMENT_CACHE = 128
+#idle connections by readonly flag
+DB_POOLS = {True: queue.LifoQueue(), False: queue.LifoQueue()}
+DB_STATS = {"open": 0, "opened": 0, "queries": 0, "query_seconds": 0.0, "slowest_query_seconds": 0.0}
+DB_STATS_LOCK = threading.Lock()
+#hero id -> name, loaded from the Heroes table by load_hero_names(), NULL for ids it lacks
+HERO_NAMES = None
+HERO_NAMES_LOCK = threading.Lock()
+#scraped team name, lowered -> team name used in ProPlayers, for teams listed under another name
+TEAM_ALIASES = {
+    "omega gaming": "Ωmega gaming",
+}
+#region -> team -> [(player, account_id)], loaded from TeamRosters by load_team_rosters()
+TEAM_ROSTERS = None
+TEAM_ROSTERS_LOCK = threading.Lock()
+#indexes for the request lookups, recreated whenever their table is rebuilt
+DB_INDEXES = {
+    "Heroes": ['CREATE INDEX IF NOT EXISTS "Heroes_name_lower" ON "Heroes"(LOWER("name"))'],
+    "ActiveProPlayers": ['CREATE INDEX IF NOT EXISTS "ActiveProPlayers_team_name" ON "ActiveProPlayers"("team_name")'],
+}
+
+#"png" renders plots on the server, "json" sends the plotted series to static/charts.js
+CHART_MODE = "png"
+#rendered plot PNGs kept in memory, the least recently used ones are dropped first
+PLOT_STORE_MAX = 256
+#content digest -> PNG bytes
+PLOTS = OrderedDict()
+PLOTS_LOCK = threading.Lock()
+#rendered kda plots kept by a hash of the plotted data, for the recently viewed players
+RENDER_CACHE_MAX = 512
+#data hash -> PNG bytes
+RENDERED = OrderedDict()
+#hero id -> (data hash, PNG bytes), one matchup plot per hero that is never evicted
+MATCHUP_PLOTS = {}
+RENDER_STATS = {"hits": 0, "renders": 0}
+#"agg", or "cairo" if pycairo is installed, figures are drawn on it directly without pyplot
+PLOT_BACKEND = "agg"
+#figures built once and redrawn with new data, see plot_template()
+PLOT_TEMPLATES = {}
+#matplotlib artists are not thread safe, one render at a time
+RENDER_LOCK = threading.Lock()
+
+#seconds between refreshes of each dataset, matching the CACHE_TTL of its sources
+REFRESH_INTERVALS = {
+    "Heroes": 24*60*60,
+    "ProPlayers": 24*60*60,
+    "ActiveProPlayers": 24*60*60,
+}
+#seconds the scheduler sleeps between checks for due refreshes
+REFRESH_POLL = 5*60
+
+#serve stored player matches at once and refresh them in the background (stale-while-revalidate)
+PLAYER_PAGE_SWR = True
+#seconds stored player matches are served without a refresh
+PLAYER_FRESH_SECONDS = 5*60
+#account ids with a background refresh running
+PLAYER_REFRESHING = set()
+PLAYER_REFRESH_LOCK = threading.Lock()
+#latency of player match fetches, background ones are counted separately
+PLAYER_FETCH_STATS = {"fetches": 0, "background": 0, "failures": 0, "seconds": 0.0, "slowest_seconds": 0.0}
+
+#local player search: shortest query answered by prefix matches,
+#and the difflib ratio a fuzzy match needs to be added after the upstream results
+PLAYER_SEARCH_MIN_PREFIX = 3
+PLAYER_SEARCH_FUZZY_CUTOFF = 0.8
+#fuzzy candidates taken from the trigram index before ranking
+PLAYER_SEARCH_CANDIDATES = 200
+PLAYER_SEARCH_STATS = {"local": 0, "upstream": 0}
+PLAYER_SEARCH_LOCK = threading.Lock()
+
+#state of the background ingestion started by start_ingestion()
+INGEST_STATUS = {"state": "idle", "started_at": None, "finished_at": None, "error": None}
+INGEST_LOCK = threading.Lock()
+
 #use flask
+FLASK_DEBUG = True
 app = Flask(__name__)
 @app.route('/')
 def index():
@@ -40,8 +226,10 @@ def handle_hero_search():
     if len(hero_result)==0:
         return render_template('not_found.html', usr_input=usr_input)
     #if found, display it
-    (name, img, bio) = hero_search_parser(hero_result)
-    return render_template('hero_page.html', name=name, img=img, bio=bio)
+    if CHART_MODE == "json":
+        return render_template('hero_page.html', name=hero_result[1], img=hero_result[2], bio=hero_result[3], chart=matchup_series(hero_result))
+    (name, img, bio, plot_url) = hero_search_parser(hero_result)
+    return render_template('hero_page.html', name=name, img=img, bio=bio, plot_url=plot_url)
 
 @app.route('/player_search')
 def player_search():
@@ -61,9 +249,37 @@ def handle_player_search():
     get_n_store_recent_matches(id_)
     #format match info helper
     (win_list, match_list, duration_list, hero_list, start_list, k_list, d_list, a_list) = format_match_info_helper(id_)
-    draw_kda_win(win_list, k_list, d_list, a_list)
+    kda_chart = kda_chart_args(id_, win_list, k_list, d_list, a_list)
     #display it
-    return render_template('match_page.html', name=name, win_list=win_list,match_list=match_list, duration_list=duration_list, hero_list=hero_list, start_list=start_list, k_list=k_list, d_list=d_list, a_list=a_list)
+    return render_template('match_page.html', name=name, win_list=win_list,match_list=match_list, duration_list=duration_list, hero_list=hero_list, start_list=start_list, k_list=k_list, d_list=d_list, a_list=a_list, **kda_chart, **data_age_args(id_))
+
+@app.route('/stats')
+def stats():
+    with PLOTS_LOCK:
+        plots = dict(RENDER_STATS)
+        plots["cached"] = len(RENDERED)
+        plots["matchups"] = len(MATCHUP_PLOTS)
+    with INGEST_LOCK:
+        ingest = dict(INGEST_STATUS)
+    ingest["datasets"] = refresh_status()
+    fetch = dict(FETCH_STATS)
+    fetch["in_flight"] = len(INFLIGHT)
+    with PLAYER_SEARCH_LOCK:
+        search = dict(PLAYER_SEARCH_STATS)
+    with PLAYER_REFRESH_LOCK:
+        players = dict(PLAYER_FETCH_STATS)
+        players["refreshing"] = len(PLAYER_REFRESHING)
+    return jsonify({"cache": cache_stats(), "db": db_stats(), "plots": plots, "ingest": ingest, "fetch": fetch, "players": players, "search": search})
+
+@app.route('/ready')
+def ready():
+    '''
+    Readiness probe, 200 once there is data to serve
+    '''
+    with INGEST_LOCK:
+        status = dict(INGEST_STATUS)
+    status["ready"] = db_ready()
+    return jsonify(status), 200 if status["ready"] else 503
 
 @app.route('/teams')
 def teams():
@@ -81,16 +297,173 @@ def handle_player_search_id():
     #get id of player
     id_ = request.form.get("id_")
     name = request.form.get("name")
-    #find matches of that player
-    get_n_store_recent_matches(id_)
+    #find matches of that player, stored ones are served while a refresh runs
+    if PLAYER_PAGE_SWR and player_fetched_at(id_) is not None:
+        refresh_recent_matches(id_)
+    else:
+        get_n_store_recent_matches(id_)
     #format match info helper
     (win_list, match_list, duration_list, hero_list, start_list, k_list, d_list, a_list) = format_match_info_helper(id_)
-    draw_kda_win(win_list, k_list, d_list, a_list)
+    kda_chart = kda_chart_args(id_, win_list, k_list, d_list, a_list)
     #display it
-    return render_template('match_page.html', name=name, win_list=win_list,match_list=match_list, duration_list=duration_list, hero_list=hero_list, start_list=start_list, k_list=k_list, d_list=d_list, a_list=a_list)
+    return render_template('match_page.html', name=name, win_list=win_list,match_list=match_list, duration_list=duration_list, hero_list=hero_list, start_list=start_list, k_list=k_list, d_list=d_list, a_list=a_list, **kda_chart, **data_age_args(id_))
+
+@app.route('/plots/<kind>/<key>/<digest>.png')
+def plot(kind, key, digest):
+    '''
+    Serve a rendered plot, the url changes with the image so it can be cached for good
+    '''
+    png = plot_lookup(digest)
+    if png is None:
+        #rendered by another worker or dropped from the store, render it again
+        png = render_plot(kind, key)
+        if png is None:
+            abort(404)
+    response = make_response(png)
+    response.mimetype = "image/png"
+    response.set_etag(plot_digest(png))
+    if plot_digest(png) == digest:
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    else:
+        #the data changed since the page was rendered, do not pin this image to the old url
+        response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
+
+def kda_chart_args(id_, win_list, k_list, d_list, a_list):
+    ''' template arguments for the kda chart of a match page
+
+    Parameters
+    ----------
+    id_: int
+        player account id
+    win_list, k_list, d_list, a_list: list
+        won/lost, kills, deaths and assists of recent matches
+
+    Returns
+    -------
+    dict
+        kda_url of the rendered plot, or chart series for CHART_MODE "json"
+    '''
+    if CHART_MODE == "json":
+        return {"chart": {"kind": "kda", "k": k_list, "d": d_list, "a": a_list}}
+    return {"kda_url": plot_url("kda", id_, cached_plot("kda", draw_kda_win, win_list, k_list, d_list, a_list))}
+
+def data_age_args(id_):
+    '''template arguments telling how old the shown matches are
+
+    Parameters
+    ----------
+    id_: int
+        player account id
+
+    Returns
+    -------
+    dict
+        age, a readable age of the stored matches or None,
+        and refreshing, True while a background refresh runs
+    '''
+    fetched_at = player_fetched_at(id_)
+    with PLAYER_REFRESH_LOCK:
+        refreshing = str(id_) in PLAYER_REFRESHING
+    if fetched_at is None:
+        return {"age": None, "refreshing": refreshing}
+    minutes = int(max(0, time.time() - fetched_at) // 60)
+    if minutes < 1:
+        age = "less than a minute"
+    elif minutes < 60:
+        age = f"{minutes} minute{'s' if minutes > 1 else ''}"
+    elif minutes < 48*60:
+        age = f"{minutes // 60} hour{'s' if minutes >= 120 else ''}"
+    else:
+        age = f"{minutes // (24*60)} days"
+    return {"age": age, "refreshing": refreshing}
+
+def plot_digest(png):
+    ''' content hash of a rendered plot
+
+    Parameters
+    ----------
+    png: bytes
+        the rendered PNG
+
+    Returns
+    -------
+    string
+        hex digest used in plot urls and as ETag
+    '''
+    return hashlib.sha1(png).hexdigest()[:16]
+
+def plot_url(kind, key, png):
+    ''' keep a rendered plot in memory and build the url serving it
+
+    Parameters
+    ----------
+    kind: string
+        "kda" or "matchup"
+    key: int
+        player account id for kda, hero id for matchup
+    png: bytes
+        the rendered PNG
+
+    Returns
+    -------
+    string
+        url of the plot
+    '''
+    digest = plot_digest(png)
+    with PLOTS_LOCK:
+        PLOTS[digest] = png
+        PLOTS.move_to_end(digest)
+        while len(PLOTS) > PLOT_STORE_MAX:
+            PLOTS.popitem(last=False)
+    return url_for('plot', kind=kind, key=key, digest=digest)
+
+def plot_lookup(digest):
+    ''' find a rendered plot by its digest
+
+    Parameters
+    ----------
+    digest: string
+        digest from plot_digest
+
+    Returns
+    -------
+    bytes
+        the PNG, None if it is not in memory
+    '''
+    with PLOTS_LOCK:
+        png = PLOTS.get(digest)
+        if png is not None:
+            PLOTS.move_to_end(digest)
+        return png
+
+def render_plot(kind, key):
+    ''' render a plot from the data currently in DB
+
+    Parameters
+    ----------
+    kind: string
+        "kda" or "matchup"
+    key: string
+        player account id for kda, hero id for matchup
+
+    Returns
+    -------
+    bytes
+        the PNG, None if there is no such plot
+    '''
+    if kind == "kda":
+        (win_list, match_list, duration_list, hero_list, start_list, k_list, d_list, a_list) = format_match_info_helper(key)
+        return cached_plot("kda", draw_kda_win, win_list, k_list, d_list, a_list)
+    if kind == "matchup":
+        hero_result = DB_query("SELECT * FROM 'Heroes' WHERE Id = ?", (key,))
+        if len(hero_result) == 0:
+            return None
+        return matchup_plot(hero_result[0])
+    return None
 
 def get_teams():
-    ''' get pro team names of each region from DB
+    ''' get pro team names of each region from the team rosters
 
     Parameters
     ----------
@@ -101,24 +474,11 @@ def get_teams():
     dict:
         team name list under region keys
     '''
-    query = f'''
-                SELECT  DISTINCT team_name, region
-                FROM    ActiveProPlayers 
-            '''
-    results = DB_query(query)
-    team_dict = {}
-    #make it dict by regions
-    for (team, region) in results:
-        #if empty init as list
-        if region not in team_dict.keys():
-            team_dict[region] = []
-        else:
-            team_dict[region].append(team)
-
-    return team_dict
+    rosters = load_team_rosters()
+    return {region: list(teams.keys()) for (region, teams) in rosters.items()}
 
 def get_players_by_team(team):
-    ''' get all pro player in the team
+    ''' get all pro player in the team from the team rosters
 
     Parameters
     ----------
@@ -127,19 +487,48 @@ def get_players_by_team(team):
 
     Returns
     -------
-    tuple:
-        list of player names and ids,  in the specified team
-    '''
-    query = f'''
-                SELECT  ActiveProPlayers.player_name    AS name, 
-                        ProPlayers.account_id           AS id_
-                FROM    ActiveProPlayers
-                        INNER JOIN ProPlayers 
-                        ON ActiveProPlayers.ProPlayers_table_id = ProPlayers.id
-                WHERE   ActiveProPlayers.team_name = '{team}'
-            '''
-    results = DB_query(query)
-    return results
+    list:
+        list of (player name, account id), in the specified team
+    '''
+    rosters = load_team_rosters()
+    members = []
+    for teams in rosters.values():
+        members.extend(teams.get(team, []))
+    return members
+
+def load_team_rosters(refresh=False):
+    ''' load the rosters of active teams from the TeamRosters table,
+    once per process or again when refresh is set
+
+    Parameters
+    ----------
+    refresh: bool
+        reload the rosters, used after TeamRosters is rebuilt
+
+    Returns
+    -------
+    dict:
+        (player name, account id) lists under team keys under region keys,
+        in the order of the teams page
+    '''
+    global TEAM_ROSTERS
+    query = '''
+        SELECT region, team_name, player_name, account_id
+        FROM TeamRosters
+        ORDER BY position
+    '''
+    with TEAM_ROSTERS_LOCK:
+        if TEAM_ROSTERS is None or refresh:
+            try:
+                results = DB_query(query)
+            except sqlite3.OperationalError:
+                #no TeamRosters table yet
+                results = []
+            rosters = {}
+            for (region, team, player, account_id) in results:
+                rosters.setdefault(region, {}).setdefault(team, []).append((player, account_id))
+            TEAM_ROSTERS = rosters
+        return TEAM_ROSTERS
 
 def format_match_info_helper(id_):
     ''' use user id_ input to find match info in DB
@@ -155,12 +544,15 @@ def format_match_info_helper(id_):
     tuple:
         tuple of match infomation lists
     '''
-    query = f'''
-                SELECT * 
+    #match ids grow over time, so the newest 10 matches are the 10 highest ids
+    query = '''
+                SELECT Id, account_id, match_id, win, duration, hero_id, start_time, kills, deaths, assists
                 FROM 'PlayerMatches'
-                WHERE account_id = '{id_}'
+                WHERE account_id = ?
+                ORDER BY match_id DESC
+                LIMIT 10
     '''
-    entries = DB_query(query)
+    entries = DB_query(query, (id_,))
     win_list = []
     match_list = []
     duration_list = []
@@ -169,8 +561,9 @@ def format_match_info_helper(id_):
     k_list = []
     d_list = []
     a_list = []
-    for (id, acnt, match, win, duration, hero_id, s_t, k, d, a) in entries:
-        hero = find_hero_name([hero_id])[0]
+    #translate all hero ids at once
+    hero_names = find_hero_name([entry[5] for entry in entries])
+    for ((id, acnt, match, win, duration, hero_id, s_t, k, d, a), hero) in zip(entries, hero_names):
         #translate 0-1 to won and lost
         if win == 1:
             win_t = "Won"
@@ -186,8 +579,74 @@ def format_match_info_helper(id_):
         a_list.append(a)
     return (win_list, match_list, duration_list, hero_list, start_list, k_list, d_list, a_list)
         
+def plot_canvas_class():
+    '''pick the canvas class of PLOT_BACKEND
+
+    Parameters
+    ----------
+    N/A
+
+    Returns
+    -------
+    class
+        FigureCanvasAgg, or FigureCanvasCairo when configured and available
+    '''
+    if PLOT_BACKEND == "cairo":
+        try:
+            from matplotlib.backends.backend_cairo import FigureCanvasCairo
+            return FigureCanvasCairo
+        except ImportError:
+            print("pycairo is not installed, drawing plots with agg")
+    return FigureCanvasAgg
+
+def plot_template(name, build):
+    '''get a prebuilt figure, building it on first use.
+    figures are never registered with pyplot, so nothing outlives the template
+    caller must hold RENDER_LOCK
+
+    Parameters
+    ----------
+    name: hashable
+        template name
+    build: function
+        returns the template tuple, starting with the figure
+
+    Returns
+    -------
+    tuple
+        the template built by build
+    '''
+    template = PLOT_TEMPLATES.get(name)
+    if template is None:
+        template = build()
+        plot_canvas_class()(template[0])
+        PLOT_TEMPLATES[name] = template
+    return template
+
+def kda_template():
+    '''build the kda figure with empty lines
+
+    Parameters
+    ----------
+    N/A
+
+    Returns
+    -------
+    tuple
+        figure, axes, (kill, death, assist) lines and legend
+    '''
+    fig = Figure(figsize=(10,2))
+    ax = fig.add_subplot()
+    (k_line,) = ax.plot([], [], 'r', marker='o', label='kill')
+    (d_line,) = ax.plot([], [], 'b', marker='x', label='death')
+    (a_line,) = ax.plot([], [], 'g', marker='d', label='assist')
+    lgd = ax.legend(bbox_to_anchor=(1.02, 1.), loc='upper left', borderaxespad=0.)
+    ax.yaxis.set_major_locator(MaxNLocator(integer=True))
+    ax.xaxis.grid(True)
+    return (fig, ax, (k_line, d_line, a_line), lgd)
+
 def draw_kda_win(win_list, k_list, d_list, a_list):
-    '''draw and store kda plot
+    '''draw kda plot in memory
 
     Parameters
     ----------
@@ -202,24 +661,25 @@ def draw_kda_win(win_list, k_list, d_list, a_list):
 
     Returns
     -------
-    N/A
+    bytes
+        the plot as PNG
     '''
-    output_file = "static/kda.png"
-    plt.figure(figsize=(10,2))
-    plt.plot(k_list, 'r', marker='o', label='kill')
-    plt.plot(d_list, 'b', marker='x', label='death')
-    plt.plot(a_list, 'g', marker='d', label='assist')
-    lgd = plt.legend(bbox_to_anchor=(1.02, 1.), loc='upper left', borderaxespad=0.)
-
-    ax = plt.gca()
-    ticks = np.arange(0, len(k_list), 1)
-    ax.set_xticks(ticks)
-    ax.yaxis.set_major_locator(MaxNLocator(integer=True))
-    ax.xaxis.grid(True)
-    #ax.grid(True)
-    ax.set_xticklabels([])
-    plt.savefig(output_file, bbox_extra_artists=(lgd,), bbox_inches='tight')
-    return
+    output_file = io.BytesIO()
+    with RENDER_LOCK:
+        (fig, ax, lines, lgd) = plot_template("kda", kda_template)
+        #only the line data changes between plots
+        for (line, values) in zip(lines, (k_list, d_list, a_list)):
+            line.set_data(np.arange(len(values)), values)
+        ticks = np.arange(0, len(k_list), 1)
+        ax.set_xticks(ticks)
+        ax.set_xticklabels([])
+        ax.relim()
+        if len(k_list) == 0:
+            #without data autoscale_view keeps the previous plot's limits, use those of an empty figure
+            ax.update_datalim([(0, 0)])
+        ax.autoscale_view()
+        fig.savefig(output_file, format='png', bbox_extra_artists=(lgd,), bbox_inches='tight')
+    return output_file.getvalue()
 
 def search_hero(usr_input):
     ''' search hero infomation in database basing on user input
@@ -235,13 +695,13 @@ def search_hero(usr_input):
     tuple:
         contains hero name, img link, bio, and matchup info
     '''
-    query = f'''
+    query = '''
                 SELECT * 
                 FROM 'Heroes'
-                WHERE LOWER(name) = '{usr_input.lower()}'
+                WHERE LOWER(name) = ?
             '''
     try:
-        rst = DB_query(query)
+        rst = DB_query(query, (usr_input.lower(),))
     except:
         return ()
     else:
@@ -252,7 +712,6 @@ def search_hero(usr_input):
 
 def hero_search_parser(hero_result):
     ''' function to parse the return entry from Heroes DB
-    find the hero name basing on the hero id
     call function to draw matchup plot
 
     Parameters
@@ -263,14 +722,135 @@ def hero_search_parser(hero_result):
     Returns
     -------
     tuple:
-        contains hero name, img link, bio
+        contains hero name, img link, bio, matchup plot url
+    '''
+    url = plot_url("matchup", hero_result[0], matchup_plot(hero_result))
+    return (hero_result[1], hero_result[2], hero_result[3], url)
+
+def matchup_plot(hero_result):
+    ''' find the hero name basing on the hero id
+    and draw the matchup plot of a Heroes DB entry
+
+    Parameters
+    ----------
+    hero_result: tuple
+        contains hero name, img link, bio, and matchup info
+
+    Returns
+    -------
+    bytes
+        the plot as PNG
+    '''
+    name_list = find_hero_name([hero_result[4],hero_result[6],hero_result[8],hero_result[10],hero_result[12],hero_result[14]])
+    data = (name_list, [hero_result[5],hero_result[7],hero_result[9],hero_result[11],hero_result[13],hero_result[15]])
+    #kept apart from the kda plots so player views do not evict them
+    data_key = plot_data_key("matchup", data)
+    with PLOTS_LOCK:
+        entry = MATCHUP_PLOTS.get(hero_result[0])
+        if entry is not None and entry[0] == data_key:
+            RENDER_STATS["hits"] += 1
+            return entry[1]
+    png = draw_matchup(*data)
+    with PLOTS_LOCK:
+        MATCHUP_PLOTS[hero_result[0]] = (data_key, png)
+        RENDER_STATS["renders"] += 1
+    return png
+
+def matchup_series(hero_result):
+    ''' the matchup chart series of a Heroes DB entry, for CHART_MODE "json"
+
+    Parameters
+    ----------
+    hero_result: tuple
+        contains hero name, img link, bio, and matchup info
+
+    Returns
+    -------
+    dict
+        matchup hero names and win rate percentages
     '''
     name_list = find_hero_name([hero_result[4],hero_result[6],hero_result[8],hero_result[10],hero_result[12],hero_result[14]])
-    draw_matchup(name_list,[hero_result[5],hero_result[7],hero_result[9],hero_result[11],hero_result[13],hero_result[15]])
-    return (hero_result[1], hero_result[2], hero_result[3])
+    rate_list = matchup_percentages([hero_result[5],hero_result[7],hero_result[9],hero_result[11],hero_result[13],hero_result[15]])
+    return {"kind": "matchup", "names": name_list, "rates": rate_list}
+
+def plot_data_key(kind, data):
+    ''' hash of the data of a plot
+
+    Parameters
+    ----------
+    kind: string
+        "kda" or "matchup"
+    data: tuple
+        the lists passed to the draw function
+
+    Returns
+    -------
+    string
+        hex digest identifying the plot
+    '''
+    return hashlib.sha1(json.dumps([kind, data]).encode()).hexdigest()
+
+def cached_plot(kind, draw, *data):
+    ''' render a plot unless the same data was plotted before
+
+    Parameters
+    ----------
+    kind: string
+        "kda" or "matchup"
+    draw: function
+        draw_kda_win or draw_matchup
+    data:
+        the lists passed to draw
+
+    Returns
+    -------
+    bytes
+        the plot as PNG
+    '''
+    data_key = plot_data_key(kind, data)
+    with PLOTS_LOCK:
+        png = RENDERED.get(data_key)
+        if png is not None:
+            RENDERED.move_to_end(data_key)
+            RENDER_STATS["hits"] += 1
+            return png
+    png = draw(*data)
+    with PLOTS_LOCK:
+        RENDERED[data_key] = png
+        while len(RENDERED) > RENDER_CACHE_MAX:
+            RENDERED.popitem(last=False)
+        RENDER_STATS["renders"] += 1
+    return png
+
+def prerender_matchup_plots():
+    ''' render the matchup plot of every hero in DB,
+    so hero pages are served without drawing.
+    nothing is rendered when CHART_MODE is "json"
+
+    Parameters
+    ----------
+    N/A
+
+    Returns
+    -------
+    int
+        number of heroes rendered
+    '''
+    if CHART_MODE == "json":
+        return 0
+    hero_results = DB_query("SELECT * FROM 'Heroes'")
+    for hero_result in hero_results:
+        matchup_plot(hero_result)
+    #drop the plots of heroes no longer in DB
+    hero_ids = {hero_result[0] for hero_result in hero_results}
+    with PLOTS_LOCK:
+        for hero_id in list(MATCHUP_PLOTS):
+            if hero_id not in hero_ids:
+                del MATCHUP_PLOTS[hero_id]
+    return len(hero_results)
 
 def draw_matchup(name_list, in_rate_list):
-    ''' draw bar diagram of hero matchups, store it in static/matchup.png
+    ''' draw bar diagram of hero matchups in memory
 
     Parameters
     ----------
@@ -281,7 +861,34 @@ def draw_matchup(name_list, in_rate_list):
 
     Returns
     -------
-    N/A
+    bytes
+        the plot as PNG
+    '''
+    rate_list = matchup_percentages(in_rate_list)
+    output_file = io.BytesIO()
+    with RENDER_LOCK:
+        (fig, ax1, rects, labels) = plot_template(("matchup", len(name_list)), lambda: matchup_template(len(name_list)))
+        #only bar widths, hero names and percentages change between plots
+        for (rect, label, rate) in zip(rects, labels, rate_list):
+            rect.set_width(rate)
+            label.set_text(str(rate))
+            label.xy = (int(rate), label.xy[1])
+        ax1.set_yticklabels(name_list)
+        fig.savefig(output_file, format='png')
+    return output_file.getvalue()
+
+def matchup_percentages(in_rate_list):
+    ''' convert matchup win ratios to rounded percentages
+
+    Parameters
+    ----------
+    in_rate_list: list
+        matchup hero win ratios
+
+    Returns
+    -------
+    list
+        win rate percentages, 0 for NULL
     '''
     rate_list = []
     for rate in in_rate_list:
@@ -292,14 +899,28 @@ def draw_matchup(name_list, in_rate_list):
         rate = rate * 100
         rate = round(rate)
         rate_list.append(rate)
+    return rate_list
+
+def matchup_template(bar_ct):
+    ''' build the matchup figure with empty bars
+
+    Parameters
+    ----------
+    bar_ct: int
+        number of bars
 
-    output_file = 'static/matchup.png'
-    fig, ax1 = plt.subplots(figsize=(9, 8))  # Create the figure
-    pos = np.arange(len(name_list))
-    rects = ax1.barh(pos, rate_list,
+    Returns
+    -------
+    tuple
+        figure, axes, bars and the percentage label of each bar
+    '''
+    fig = Figure(figsize=(9, 8))
+    ax1 = fig.add_subplot()
+    pos = np.arange(bar_ct)
+    rects = ax1.barh(pos, [0] * bar_ct,
                      align='center',
                      height=0.5,
-                     tick_label=name_list)
+                     tick_label=[""] * bar_ct)
     ax1.set_title('3 Worst Against Heroes and 3 Best Against Heroes')
     ax1.set_xlim([0, 100])
     ax1.xaxis.grid(True, linestyle='--', which='major',
@@ -309,20 +930,46 @@ def draw_matchup(name_list, in_rate_list):
     ax1.axvline(50, color='grey', alpha=0.25)
     ax1.set_xlabel('Win rate percentage')
     #print percentage in bars
-    for i in range(len(rects)):
-        rect = rects[i]
+    labels = []
+    for rect in rects:
         xloc = -5
         yloc = rect.get_y() + rect.get_height() / 2
-        width = int(rect.get_width())
         label = ax1.annotate(
-                str(rate_list[i]), xy=(width, yloc), xytext=(xloc, 0),
+                "", xy=(0, yloc), xytext=(xloc, 0),
                 textcoords="offset points",
                 horizontalalignment='right', verticalalignment='center',
                 weight='bold', clip_on=True)
-    plt.savefig(output_file)
+        labels.append(label)
+    return (fig, ax1, rects, labels)
+
+def load_hero_names(refresh=False):
+    ''' load the hero id to name index from the Heroes table,
+    once per process or again when refresh is set
+
+    Parameters
+    ----------
+    refresh: bool
+        reload the index, used after the Heroes table is rebuilt
+
+    Returns
+    -------
+    dict:
+        hero names under hero id keys
+    '''
+    global HERO_NAMES
+    with HERO_NAMES_LOCK:
+        if HERO_NAMES is None or refresh:
+            try:
+                HERO_NAMES = dict(DB_query("SELECT Id, name FROM Heroes"))
+            except sqlite3.OperationalError:
+                #no Heroes table yet
+                HERO_NAMES = {}
+        return HERO_NAMES
 
 def find_hero_name(id_list):
-    ''' search DB to translate hero_id to hero name
+    ''' translate hero_id to hero name with the in-memory index,
+    ids missing from it are looked up in DB with one query,
+    ids missing from DB too are kept as NULL until the index is reloaded
 
     Parameters
     ----------
@@ -334,27 +981,38 @@ def find_hero_name(id_list):
     list:
         list of hero names
     '''
-    name_list = []
+    global HERO_NAMES
+    hero_names = load_hero_names()
+    missing = set()
     for id_ in id_list:
-        if id_ == "NULL":
-            name_list.append("NULL")
-            continue
+        if id_ != "NULL" and int(id_) not in hero_names:
+            missing.add(int(id_))
+    if len(missing) > 0:
+        placeholders = ", ".join(["?"] * len(missing))
         query = f'''
-            SELECT name 
+            SELECT Id, name
             FROM 'Heroes'
-            WHERE Id = '{id_}'
+            WHERE Id IN ({placeholders})
         '''
-        name = DB_query(query)
-        if name == []:
+        found = dict(DB_query(query, tuple(missing)))
+        with HERO_NAMES_LOCK:
+            hero_names = dict(HERO_NAMES)
+            for id_ in missing:
+                hero_names[id_] = found.get(id_, "NULL")
+            HERO_NAMES = hero_names
+    name_list = []
+    for id_ in id_list:
+        if id_ == "NULL":
             name_list.append("NULL")
             continue
-        name = name[0][0]
-        name_list.append(name)
+        name_list.append(hero_names.get(int(id_), "NULL"))
     return name_list
 
 def open_cache():
     ''' opens the cache file if it exists and loads the JSON into
-    the CACHE dictionary.
+    the CACHE dictionary, then replays the entries appended to the
+    journal since the cache file was last rewritten.
+    store times are kept under the "__stored_at__" key
 
     if the cache file doesn't exist, creates a new cache dictionary
 
@@ -366,6 +1024,7 @@ def open_cache():
     -------
     The opened cache
     '''
+    global CACHE_JOURNAL_CT
     try:
         cache_file = open(CACHE_FILENAME, 'r')
         cache_contents = cache_file.read()
@@ -373,190 +1032,1528 @@ def open_cache():
         cache_file.close()
     except:
         cache_dict = {}
+    #entries written before store times were kept count as stored at epoch 0
+    stored_at = cache_dict.setdefault("__stored_at__", {})
+    CACHE_JOURNAL_CT = 0
+    try:
+        journal = open(CACHE_JOURNAL_FILENAME, 'r')
+    except OSError:
+        return cache_dict
+    for line in journal:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            #a flush interrupted half way, skip the partial line
+            continue
+        key = entry["key"]
+        if entry.get("deleted"):
+            cache_dict.pop(key, None)
+            stored_at.pop(key, None)
+        else:
+            cache_dict[key] = entry["value"]
+            stored_at[key] = entry.get("time", 0)
+        CACHE_JOURNAL_CT += 1
+    journal.close()
     return cache_dict
 
 def save_cache(cache_dict):
     ''' saves the current state of the cache to disk
+    the file is written aside and renamed over the old one,
+    so a crash never leaves a half written cache behind
     Parameters
     ----------
     cache_dict: dict
-        The dictionary to save
+        The dictionary to save
     Returns
     -------
     None
     '''
     dumped_json_cache = json.dumps(cache_dict)
-    fw = open(CACHE_FILENAME,"w")
+    tmp_filename = CACHE_FILENAME + ".tmp"
+    fw = open(tmp_filename,"w")
     fw.write(dumped_json_cache)
+    fw.flush()
+    os.fsync(fw.fileno())
     fw.close()
+    os.replace(tmp_filename, CACHE_FILENAME)
 
-def construct_unique_key(category, params):
-    ''' constructs a key that is guaranteed to uniquely and 
-    repeatably identify an API request by its params, API_KEY is not cached here
+def open_cache_db():
+    ''' open a new connection to the sqlite cache,
+    the first one creates the cache table
 
     Parameters
     ----------
-    category: string
-        A piece of url after the base url for the search category
-    params: dict
-        A dictionary of param:value pairs, without api_key
-    
+    None
+
     Returns
     -------
-    string
-        the unique key as a string
+    sqlite3.Connection
+        connection to CACHE_DB_FILENAME
     '''
-    param_strings = []
-    connector = '_'
-    for k in params.keys():
-        param_strings.append(f'{k}_{params[k]}')
-    param_strings.sort()
-    unique_key = category + connector + connector.join(param_strings)
-    return unique_key
+    global CACHE_DB_READY
+    conn = sqlite3.connect(CACHE_DB_FILENAME, timeout=30, check_same_thread=False)
+    #WAL lets several worker processes read while one of them writes
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    if not CACHE_DB_READY:
+        create_cache = '''
+            CREATE TABLE IF NOT EXISTS "cache"(
+                "key"           TEXT PRIMARY KEY,
+                "value"         TEXT NOT NULL,
+                "stored_at"     REAL NOT NULL,
+                "accessed_at"   REAL NOT NULL
+            );
+        '''
+        conn.execute(create_cache)
+        #caches created before accessed_at count their entries as last read when stored
+        columns = [column for (_, column, *_) in conn.execute('PRAGMA table_info("cache")')]
+        if "accessed_at" not in columns:
+            conn.execute('ALTER TABLE "cache" ADD COLUMN "accessed_at" REAL NOT NULL DEFAULT 0')
+            conn.execute('UPDATE "cache" SET accessed_at = stored_at')
+        conn.execute('CREATE INDEX IF NOT EXISTS "cache_stored_at" ON "cache"("stored_at")')
+        conn.execute('CREATE INDEX IF NOT EXISTS "cache_accessed_at" ON "cache"("accessed_at")')
+        conn.commit()
+        CACHE_DB_READY = True
+    return conn
+
+@contextmanager
+def cache_db():
+    ''' borrow a pooled connection to the sqlite cache,
+    it goes back to the pool afterwards
 
-def get_data(category, params):
-    '''Obtain API data from OpenDota API.
-    
     Parameters
     ----------
-    category: string
-        A piece of url after the base url for the search category
-    params: dict
-        a dictionary of parameters without API_KEY
-    arg: string
-        put between url and params followed by a question mark
-    
+    None
+
     Returns
     -------
-    dict
-        a converted API return from Dota2 API
+    sqlite3.Connection
+        the borrowed connection
     '''
-    base_url = "http://api.opendota.com/api/"
-    rst_dict = {}
-    cache = open_cache()
-    #check cache
-    cache_key = construct_unique_key(category, params)
-    if(cache_key in cache):
-        print(f"Using cache {cache_key}")
-        return cache[cache_key]
-    #if not in cache
-    print(f"Fetching {cache_key}")
-    #add api_key to params
-    params["api_key"] = secrets.API_KEY
+    try:
+        conn = CACHE_DB_POOL.get_nowait()
+    except queue.Empty:
+        conn = open_cache_db()
+    try:
+        yield conn
+    except:
+        conn.rollback()
+        raise
+    finally:
+        if CACHE_DB_POOL.qsize() < DB_POOL_SIZE:
+            CACHE_DB_POOL.put(conn)
+        else:
+            conn.close()
 
-    #request
-    response = requests.get(url=base_url+category, params=params)
-    rst_dict = json.loads(response.text)
-    #save to cache
-    cache[cache_key] = rst_dict
-    save_cache(cache)
+def close_cache_db():
+    ''' close every idle pooled cache connection, called at shutdown
+    after the last flush
 
-    return rst_dict
+    Returns
+    -------
+    N/A
+    '''
+    while True:
+        try:
+            conn = CACHE_DB_POOL.get_nowait()
+        except queue.Empty:
+            break
+        conn.close()
+
+#registered before flush_cache, atexit runs it after the last flush
+atexit.register(close_cache_db)
+
+def migrate_cache_to_sqlite():
+    ''' one-shot copy of every entry of the JSON cache (and its journal)
+    into the sqlite cache
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    int
+        number of migrated entries
+    '''
+    cache_dict = open_cache()
+    stored_at = cache_dict.pop("__stored_at__")
+    rows = []
+    for key in cache_dict.keys():
+        rows.append((key, json.dumps(cache_dict[key]), stored_at.get(key, 0), stored_at.get(key, 0)))
+    insert_cache = '''
+        INSERT OR REPLACE INTO cache
+        VALUES (?, ?, ?, ?)
+    '''
+    with cache_db() as conn, conn:
+        conn.executemany(insert_cache, rows)
+    print(f"Migrated {len(rows)} cache entries to {CACHE_DB_FILENAME}")
+    return len(rows)
+
+def cache_ttl(cache_key):
+    ''' find how long an entry stays fresh
+
+    Parameters
+    ----------
+    cache_key: string
+        key built by construct_unique_key
+
+    Returns
+    -------
+    int:
+        seconds the entry stays fresh, None if it never expires
+    '''
+    for (pattern, ttl) in CACHE_TTL:
+        if fnmatch.fnmatchcase(cache_key, pattern):
+            return ttl
+    return None
+
+def cache_expired(cache_key, stored_at):
+    ''' check whether an entry stored at stored_at has outlived its TTL
+
+    Parameters
+    ----------
+    cache_key: string
+        key built by construct_unique_key
+    stored_at: float
+        epoch time the entry was stored
+
+    Returns
+    -------
+    bool
+        True if the entry is stale
+    '''
+    ttl = cache_ttl(cache_key)
+    if ttl is None:
+        return False
+    return time.time() - stored_at > ttl
+
+def cache_remember(cache_key, value, stored_at):
+    ''' put an entry in the in-process cache as the most recently used one,
+    evict least recently used entries beyond CACHE_MAX_ENTRIES
+    caller must hold CACHE_LOCK
+
+    Parameters
+    ----------
+    cache_key: string
+        key built by construct_unique_key
+    value:
+        JSON serializable value to cache
+    stored_at: float
+        epoch time the entry was stored
+
+    Returns
+    -------
+    None
+    '''
+    CACHE[cache_key] = value
+    CACHE.move_to_end(cache_key)
+    CACHE_TIMES[cache_key] = stored_at
+    if is_blob_ref(value):
+        CACHE_BLOBS[cache_key] = value
+    else:
+        CACHE_BLOBS.pop(cache_key, None)
+    while len(CACHE) > CACHE_MAX_ENTRIES:
+        (old_key, old_value) = CACHE.popitem(last=False)
+        CACHE_TIMES.pop(old_key, None)
+        CACHE_BLOBS.pop(old_key, None)
+        CACHE_STATS["evictions"] += 1
+        #the sqlite backend keeps evicted entries on disk, trimmed by flush_cache_sqlite
+        if CACHE_BACKEND != "sqlite":
+            CACHE_DIRTY[old_key] = None
+
+def cache_forget(cache_key):
+    ''' drop an entry from the in-process cache and from disk on the next flush
+    caller must hold CACHE_LOCK
+
+    Parameters
+    ----------
+    cache_key: string
+        key built by construct_unique_key
+
+    Returns
+    -------
+    None
+    '''
+    CACHE.pop(cache_key, None)
+    CACHE_TIMES.pop(cache_key, None)
+    CACHE_BLOBS.pop(cache_key, None)
+    CACHE_DIRTY[cache_key] = None
+
+def is_blob_ref(value):
+    ''' check whether a cached value is a reference to the blob store
+
+    Parameters
+    ----------
+    value:
+        a cached value
+
+    Returns
+    -------
+    bool
+        True for a {"__blob__": file name} reference
+    '''
+    return isinstance(value, dict) and len(value) == 1 and "__blob__" in value
+
+def blob_codec(name):
+    ''' compress and decompress functions of a blob file
+
+    Parameters
+    ----------
+    name: string
+        file name of the blob, its extension tells the codec
+
+    Returns
+    -------
+    tuple
+        (compress, decompress) functions, raises ImportError for a zstd blob without zstandard
+    '''
+    if name.endswith(".zst"):
+        import zstandard
+        return (zstandard.ZstdCompressor().compress, zstandard.ZstdDecompressor().decompress)
+    return (gzip.compress, gzip.decompress)
+
+def blob_extension():
+    ''' file extension of new blobs, from CACHE_BLOB_CODEC
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    string
+        ".json.zst" or ".json.gz"
+    '''
+    if CACHE_BLOB_CODEC == "zstd":
+        try:
+            import zstandard
+            return ".json.zst"
+        except ImportError:
+            pass
+    return ".json.gz"
+
+def store_blob(value):
+    ''' write a large value to the blob store, identical values share one file
+
+    Parameters
+    ----------
+    value:
+        JSON serializable value to store
+
+    Returns
+    -------
+    dict
+        the {"__blob__": file name} reference, None if the value is below CACHE_BLOB_THRESHOLD
+    '''
+    data = json.dumps(value).encode("utf-8")
+    if len(data) < CACHE_BLOB_THRESHOLD:
+        return None
+    name = hashlib.sha256(data).hexdigest() + blob_extension()
+    path = os.path.join(CACHE_BLOB_DIR, name)
+    if os.path.exists(path):
+        #reused content, refresh its age for gc_cache_blobs
+        os.utime(path)
+    else:
+        os.makedirs(CACHE_BLOB_DIR, exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        fw = open(tmp_path, "wb")
+        fw.write(blob_codec(name)[0](data))
+        fw.close()
+        os.replace(tmp_path, path)
+    return {"__blob__": name}
+
+def blob_or_value(cache_key, value):
+    ''' what to write to disk for a cache entry, its blob reference
+    when the value is large, otherwise the value itself
+
+    Parameters
+    ----------
+    cache_key: string
+        key built by construct_unique_key
+    value:
+        the cached value
+
+    Returns
+    -------
+    the blob reference or the value
+    '''
+    if is_blob_ref(value):
+        return value
+    with CACHE_LOCK:
+        #already in the blob store since the last flush
+        if cache_key in CACHE_BLOBS and CACHE.get(cache_key) is value:
+            return CACHE_BLOBS[cache_key]
+    ref = store_blob(value)
+    if ref is None:
+        return value
+    with CACHE_LOCK:
+        #the entry may have been replaced while the blob was written
+        if CACHE.get(cache_key) is value:
+            CACHE_BLOBS[cache_key] = ref
+    return ref
+
+def resolve_blob(cache_key, ref):
+    ''' read the value of a blob reference found in the cache,
+    an unreadable blob drops the entry
+
+    Parameters
+    ----------
+    cache_key: string
+        key built by construct_unique_key
+    ref: dict
+        the {"__blob__": file name} reference
+
+    Returns
+    -------
+    the cached value, None if the blob cannot be read
+    '''
+    name = ref["__blob__"]
+    try:
+        fr = open(os.path.join(CACHE_BLOB_DIR, name), "rb")
+        data = fr.read()
+        fr.close()
+        value = json.loads(blob_codec(name)[1](data))
+    except (OSError, ValueError, ImportError) as e:
+        print(f"Dropping cache entry {cache_key}, cannot read blob {name}: {e}")
+        with CACHE_LOCK:
+            if CACHE.get(cache_key) is ref:
+                cache_forget(cache_key)
+            #counted as a hit by cache_lookup
+            CACHE_STATS["hits"] -= 1
+            CACHE_STATS["misses"] += 1
+        return None
+    with CACHE_LOCK:
+        CACHE_STATS["blob_reads"] += 1
+        #keep the value in memory, the reference stays valid for the next flush
+        if CACHE.get(cache_key) is ref:
+            CACHE[cache_key] = value
+    return value
+
+def gc_cache_blobs(referenced):
+    ''' delete blobs no cache entry refers to any more
+
+    Parameters
+    ----------
+    referenced: set
+        file names of the blobs still referenced
+
+    Returns
+    -------
+    int
+        number of deleted blobs
+    '''
+    try:
+        names = os.listdir(CACHE_BLOB_DIR)
+    except OSError:
+        return 0
+    now = time.time()
+    removed = 0
+    for name in names:
+        if name in referenced:
+            continue
+        path = os.path.join(CACHE_BLOB_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > CACHE_BLOB_GRACE:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            #removed by another process
+            pass
+    return removed
+
+def load_cache():
+    ''' load the cache once per process and start the background flusher
+    with the sqlite backend only entries read or written by this process
+    are kept in memory, the rest stay in CACHE_DB_FILENAME
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    dict
+        the in-process cache
+    '''
+    global CACHE, CACHE_FLUSHER
+    with CACHE_LOCK:
+        if CACHE is None:
+            if CACHE_BACKEND == "sqlite":
+                json_cache = os.path.exists(CACHE_FILENAME) or os.path.exists(CACHE_JOURNAL_FILENAME)
+                migrate = json_cache and not os.path.exists(CACHE_DB_FILENAME)
+                if migrate:
+                    migrate_cache_to_sqlite()
+                CACHE = OrderedDict()
+            else:
+                cache_dict = open_cache()
+                stored_at = cache_dict.pop("__stored_at__")
+                CACHE = OrderedDict()
+                for key in cache_dict.keys():
+                    cache_remember(key, cache_dict[key], stored_at.get(key, 0))
+        if CACHE_FLUSHER is None:
+            CACHE_FLUSHER = threading.Thread(target=cache_flusher, daemon=True)
+            CACHE_FLUSHER.start()
+    return CACHE
+
+def cache_get(cache_key):
+    ''' look up a fresh entry in the in-process cache,
+    fall back to the sqlite cache when that backend is used
+
+    Parameters
+    ----------
+    cache_key: string
+        key built by construct_unique_key
+
+    Returns
+    -------
+    the cached value, None if the key is not cached or has expired
+    '''
+    return cache_lookup(cache_key)[0]
+
+def cache_lookup(cache_key):
+    ''' cache_get that also tells when the entry was stored
+
+    Parameters
+    ----------
+    cache_key: string
+        key built by construct_unique_key
+
+    Returns
+    -------
+    tuple
+        the cached value and the epoch time it was stored,
+        (None, None) if the key is not cached or has expired
+    '''
+    cache = load_cache()
+    with CACHE_LOCK:
+        value = cache.get(cache_key)
+        if value is not None:
+            stored_at = CACHE_TIMES[cache_key]
+            if not cache_expired(cache_key, stored_at):
+                cache.move_to_end(cache_key)
+                CACHE_STATS["hits"] += 1
+                if CACHE_BACKEND == "sqlite":
+                    CACHE_ACCESSED[cache_key] = time.time()
+                if not is_blob_ref(value):
+                    return (value, stored_at)
+            else:
+                cache_forget(cache_key)
+                CACHE_STATS["expired"] += 1
+                value = None
+        if value is None and CACHE_BACKEND != "sqlite":
+            CACHE_STATS["misses"] += 1
+            return (None, None)
+    #entry of the blob store, read it outside the lock
+    if value is not None:
+        return blob_lookup(cache_key, value, stored_at)
+    query = '''
+        SELECT value, stored_at
+        FROM cache
+        WHERE key = ?
+    '''
+    with cache_db() as conn:
+        row = conn.execute(query, (cache_key,)).fetchone()
+    with CACHE_LOCK:
+        if row is None:
+            CACHE_STATS["misses"] += 1
+            return (None, None)
+        if cache_expired(cache_key, row[1]):
+            CACHE_STATS["expired"] += 1
+            CACHE_STATS["misses"] += 1
+            return (None, None)
+        value = json.loads(row[0])
+        if cache_key not in cache:
+            cache_remember(cache_key, value, row[1])
+        CACHE_STATS["hits"] += 1
+        CACHE_ACCESSED[cache_key] = time.time()
+    if is_blob_ref(value):
+        return blob_lookup(cache_key, value, row[1])
+    return (value, row[1])
+
+def blob_lookup(cache_key, ref, stored_at):
+    ''' resolve_blob for cache_lookup
+
+    Parameters
+    ----------
+    cache_key: string
+        key built by construct_unique_key
+    ref: dict
+        the {"__blob__": file name} reference
+    stored_at: float
+        epoch time the entry was stored
+
+    Returns
+    -------
+    tuple
+        the cached value and stored_at, (None, None) if the blob cannot be read
+    '''
+    value = resolve_blob(cache_key, ref)
+    if value is None:
+        return (None, None)
+    return (value, stored_at)
+
+def cache_set(cache_key, value):
+    ''' store an entry in the in-process cache,
+    it is written to disk by the next flush
+
+    Parameters
+    ----------
+    cache_key: string
+        key built by construct_unique_key
+    value:
+        JSON serializable value to cache
+
+    Returns
+    -------
+    None
+    '''
+    load_cache()
+    now = time.time()
+    with CACHE_LOCK:
+        cache_remember(cache_key, value, now)
+        CACHE_DIRTY[cache_key] = (value, now)
+
+def cache_stats():
+    ''' snapshot of the cache counters
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    dict
+        hit/miss/expired/eviction counters and the in-process entry count
+    '''
+    with CACHE_LOCK:
+        stats = dict(CACHE_STATS)
+        stats["entries"] = 0 if CACHE is None else len(CACHE)
+        stats["blobs"] = len(CACHE_BLOBS)
+    stats["backend"] = CACHE_BACKEND
+    return stats
+
+def flush_cache():
+    ''' write the entries changed since the last flush to disk in one batch
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    None
+    '''
+    global CACHE_DIRTY, CACHE_ACCESSED
+    with CACHE_FLUSH_LOCK:
+        with CACHE_LOCK:
+            if CACHE is None or (len(CACHE_DIRTY) == 0 and len(CACHE_ACCESSED) == 0):
+                return
+            dirty = CACHE_DIRTY
+            CACHE_DIRTY = {}
+            accessed = CACHE_ACCESSED
+            CACHE_ACCESSED = {}
+        if CACHE_BACKEND == "sqlite":
+            flush_cache_sqlite(dirty, accessed)
+        else:
+            flush_cache_json(dirty)
+
+def flush_cache_json(dirty):
+    ''' append changed entries to the journal,
+    rewrite the whole cache file when the journal grows too long
+
+    Parameters
+    ----------
+    dirty: dict
+        entries changed since the last flush
+
+    Returns
+    -------
+    None
+    '''
+    global CACHE_JOURNAL_CT
+    lines = []
+    for key in dirty.keys():
+        if dirty[key] is None:
+            lines.append(json.dumps({"key": key, "deleted": True}) + "\n")
+            continue
+        (value, stored_at) = dirty[key]
+        value = blob_or_value(key, value)
+        lines.append(json.dumps({"key": key, "value": value, "time": stored_at}) + "\n")
+    fw = open(CACHE_JOURNAL_FILENAME, "a")
+    fw.write("".join(lines))
+    fw.flush()
+    os.fsync(fw.fileno())
+    fw.close()
+    CACHE_JOURNAL_CT += len(lines)
+    if CACHE_JOURNAL_CT < CACHE_COMPACT_THRESHOLD:
+        return
+    #everything in the journal is now in CACHE, fold it into the cache file
+    #entries changed after the snapshot stay dirty for the next flush
+    with CACHE_LOCK:
+        snapshot = dict(CACHE)
+        stored_at = dict(CACHE_TIMES)
+    #the cache file only holds references to large values
+    for key in snapshot.keys():
+        snapshot[key] = blob_or_value(key, snapshot[key])
+    referenced = {value["__blob__"] for value in snapshot.values() if is_blob_ref(value)}
+    snapshot["__stored_at__"] = stored_at
+    save_cache(snapshot)
+    open(CACHE_JOURNAL_FILENAME, "w").close()
+    CACHE_JOURNAL_CT = 0
+    gc_cache_blobs(referenced)
+
+def flush_cache_sqlite(dirty, accessed):
+    ''' upsert changed entries into the sqlite cache in one transaction,
+    then drop expired rows and the least recently used rows beyond CACHE_MAX_ENTRIES
+
+    Parameters
+    ----------
+    dirty: dict
+        entries changed since the last flush
+    accessed: dict
+        time of the last hit of entries read since the last flush
+
+    Returns
+    -------
+    None
+    '''
+    rows = []
+    removed = []
+    for key in dirty.keys():
+        if dirty[key] is None:
+            removed.append((key,))
+            continue
+        (value, stored_at) = dirty[key]
+        rows.append((key, json.dumps(blob_or_value(key, value)), stored_at, stored_at))
+    insert_cache = '''
+        INSERT OR REPLACE INTO cache
+        VALUES (?, ?, ?, ?)
+    '''
+    touch_cache = '''
+        UPDATE cache
+        SET accessed_at = MAX(accessed_at, ?)
+        WHERE key = ?
+    '''
+    delete_cache = '''
+        DELETE FROM cache
+        WHERE key = ?
+    '''
+    #GLOB uses the same * wildcard as the CACHE_TTL patterns
+    delete_expired = '''
+        DELETE FROM cache
+        WHERE key GLOB ? AND stored_at < ?
+    '''
+    trim_cache = '''
+        DELETE FROM cache
+        WHERE key IN (SELECT key FROM cache ORDER BY accessed_at LIMIT ?)
+    '''
+    now = time.time()
+    with cache_db() as conn:
+        with conn:
+            conn.executemany(insert_cache, rows)
+            conn.executemany(touch_cache, [(accessed_at, key) for (key, accessed_at) in accessed.items()])
+            #rows replaced or deleted may have held the last reference to a blob
+            changes = conn.total_changes
+            conn.executemany(delete_cache, removed)
+            for (pattern, ttl) in CACHE_TTL:
+                conn.execute(delete_expired, (pattern, now - ttl))
+            extra = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - CACHE_MAX_ENTRIES
+            if extra > 0:
+                conn.execute(trim_cache, (extra,))
+            deleted = conn.total_changes - changes
+        if deleted > 0:
+            refs = conn.execute("""SELECT value FROM cache WHERE value LIKE '{"__blob__"%'""").fetchall()
+            gc_cache_blobs({json.loads(value)["__blob__"] for (value,) in refs})
+
+def cache_flusher():
+    ''' background loop flushing changed cache entries to disk
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    N/A
+    '''
+    while True:
+        time.sleep(CACHE_FLUSH_INTERVAL)
+        try:
+            flush_cache()
+        except Exception as e:
+            print(f"Cache flush failed: {e}")
+
+atexit.register(flush_cache)
+
+def get_session():
+    ''' get the shared keep-alive session, pooled connections are
+    reused across calls and retried with exponential backoff
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    requests.Session
+        the shared session
+    '''
+    global HTTP_SESSION
+    with HTTP_LOCK:
+        if HTTP_SESSION is None:
+            retry = Retry(total=HTTP_RETRIES, backoff_factor=HTTP_BACKOFF,
+                          status_forcelist=(429, 500, 502, 503, 504),
+                          allowed_methods=frozenset(["GET"]),
+                          respect_retry_after_header=True,
+                          raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=len(RATE_LIMITS), pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            HTTP_SESSION = session
+    return HTTP_SESSION
+
+def rate_limit_delay(host):
+    ''' take a token from the host's bucket,
+    tokens are reserved ahead so concurrent callers queue up in order
+
+    Parameters
+    ----------
+    host: string
+        host name of the request
+
+    Returns
+    -------
+    float
+        seconds to wait before sending the request
+    '''
+    if host not in RATE_LIMITS:
+        return 0
+    (rate, burst) = RATE_LIMITS[host]
+    with RATE_LOCK:
+        now = time.monotonic()
+        bucket = RATE_BUCKETS.setdefault(host, [burst, now])
+        tokens = min(burst, bucket[0] + (now - bucket[1]) * rate) - 1
+        bucket[0] = tokens
+        bucket[1] = now
+    if tokens >= 0:
+        return 0
+    return -tokens / rate
+
+def http_get(url, params=None):
+    ''' rate limited GET through the shared session
+
+    Parameters
+    ----------
+    url: string
+        the url to fetch
+    params: dict
+        query parameters
+
+    Returns
+    -------
+    requests.Response
+        the response, raises requests.HTTPError if it still fails after retries
+    '''
+    delay = rate_limit_delay(urlparse(url).hostname)
+    if delay > 0:
+        time.sleep(delay)
+    response = get_session().get(url, params=params, timeout=HTTP_TIMEOUT)
+    response.raise_for_status()
+    return response
+
+def construct_unique_key(category, params):
+    ''' constructs a key that is guaranteed to uniquely and 
+    repeatably identify an API request by its params, API_KEY is not cached here
+
+    Parameters
+    ----------
+    category: string
+        A piece of url after the base url for the search category
+    params: dict
+        A dictionary of param:value pairs, without api_key
+    
+    Returns
+    -------
+    string
+        the unique key as a string
+    '''
+    param_strings = []
+    connector = '_'
+    for k in params.keys():
+        param_strings.append(f'{k}_{params[k]}')
+    param_strings.sort()
+    unique_key = category + connector + connector.join(param_strings)
+    return unique_key
+
+def fetch_loop():
+    ''' get the event loop the async fetches run on,
+    it runs in a daemon thread started on first use
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    asyncio.AbstractEventLoop
+        the running fetch loop
+    '''
+    global FETCH_LOOP
+    with FETCH_LOOP_LOCK:
+        if FETCH_LOOP is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="fetch-loop", daemon=True).start()
+            FETCH_LOOP = loop
+    return FETCH_LOOP
+
+def run_async(coro):
+    ''' run a coroutine on the fetch loop and wait for its result,
+    the sync entry point for callers outside the loop
+
+    Parameters
+    ----------
+    coro: coroutine
+        the coroutine to run
+
+    Returns
+    -------
+    object
+        the result of the coroutine, its exception is raised here
+    '''
+    return asyncio.run_coroutine_threadsafe(coro, fetch_loop()).result()
+
+def close_fetch_loop():
+    ''' close the aiohttp session and stop the fetch loop, called at shutdown
+
+    Returns
+    -------
+    N/A
+    '''
+    if FETCH_LOOP is None:
+        return
+    if FETCH_SESSION:
+        run_async(FETCH_SESSION.close())
+    FETCH_LOOP.call_soon_threadsafe(FETCH_LOOP.stop)
+
+atexit.register(close_fetch_loop)
+
+def fetch_session():
+    ''' get the aiohttp session of the fetch loop, must be called on the loop
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    aiohttp.ClientSession
+        the shared session, False when aiohttp is not installed
+    '''
+    global FETCH_SESSION
+    if FETCH_SESSION is None:
+        try:
+            import aiohttp
+            connector = aiohttp.TCPConnector(limit=HTTP_POOL_SIZE)
+            timeout = aiohttp.ClientTimeout(sock_connect=HTTP_TIMEOUT[0], sock_read=HTTP_TIMEOUT[1])
+            FETCH_SESSION = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        except ImportError:
+            print("aiohttp is not installed, fetching through requests in worker threads")
+            FETCH_SESSION = False
+    return FETCH_SESSION
+
+async def http_get_async(url, params=None):
+    ''' rate limited GET on the fetch loop, waiting for a token or a retry
+    does not hold a thread. uses aiohttp, or the requests session in the
+    loop's worker threads when aiohttp is not installed
+
+    Parameters
+    ----------
+    url: string
+        the url to fetch
+    params: dict
+        query parameters
+
+    Returns
+    -------
+    string
+        the response body, raises on a failed response after retries
+    '''
+    delay = rate_limit_delay(urlparse(url).hostname)
+    if delay > 0:
+        await asyncio.sleep(delay)
+    session = fetch_session()
+    if not session:
+        loop = asyncio.get_running_loop()
+        response = await loop.run_in_executor(None, lambda: get_session().get(url, params=params, timeout=HTTP_TIMEOUT))
+        response.raise_for_status()
+        return response.text
+    import aiohttp
+    #same retry policy as the Retry of get_session
+    for attempt in range(HTTP_RETRIES + 1):
+        wait = HTTP_BACKOFF * 2**attempt
+        try:
+            async with session.get(url, params=params) as response:
+                if response.status in (429, 500, 502, 503, 504) and attempt < HTTP_RETRIES:
+                    retry_after = response.headers.get("Retry-After", "")
+                    if retry_after.isdigit():
+                        wait = max(wait, int(retry_after))
+                else:
+                    response.raise_for_status()
+                    return await response.text()
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if attempt == HTTP_RETRIES:
+                raise
+        await asyncio.sleep(wait)
+
+async def get_data_async(category, params, force=False):
+    '''Obtain API data from OpenDota API on the fetch loop,
+    concurrent misses of the same request share one upstream fetch
+    
+    Parameters
+    ----------
+    category: string
+        A piece of url after the base url for the search category
+    params: dict
+        a dictionary of parameters without API_KEY
+    force: bool
+        skip the cache lookup and fetch, the result still replaces the cached one
+    
+    Returns
+    -------
+    dict
+        a converted API return from Dota2 API
+    '''
+    #check cache in a worker thread, the cache may block on its database
+    cache_key = construct_unique_key(category, params)
+    if not force:
+        cached = await asyncio.get_running_loop().run_in_executor(None, cache_get, cache_key)
+        if cached is not None:
+            print(f"Using cache {cache_key}")
+            return cached
+    return await fetch_coalesced(category, params, cache_key)
+
+async def fetch_coalesced(category, params, cache_key):
+    '''join the fetch of a request in flight or start one
+    
+    Parameters
+    ----------
+    category: string
+        A piece of url after the base url for the search category
+    params: dict
+        a dictionary of parameters without API_KEY
+    cache_key: string
+        the key of the request from construct_unique_key
+    
+    Returns
+    -------
+    dict
+        a converted API return from Dota2 API
+    '''
+    task = INFLIGHT.get(cache_key)
+    if task is None:
+        print(f"Fetching {cache_key}")
+        FETCH_STATS["fetches"] += 1
+        task = asyncio.ensure_future(fetch_data_async(category, params, cache_key))
+        INFLIGHT[cache_key] = task
+        task.add_done_callback(lambda _: INFLIGHT.pop(cache_key, None))
+    else:
+        print(f"Waiting for fetch {cache_key}")
+        FETCH_STATS["coalesced"] += 1
+    #a cancelled waiter leaves the fetch running for the others
+    return await asyncio.shield(task)
+
+async def fetch_data_async(category, params, cache_key):
+    '''fetch API data from OpenDota API and cache it
+    
+    Parameters
+    ----------
+    category: string
+        A piece of url after the base url for the search category
+    params: dict
+        a dictionary of parameters without API_KEY
+    cache_key: string
+        the key of the request from construct_unique_key
+    
+    Returns
+    -------
+    dict
+        a converted API return from Dota2 API
+    '''
+    base_url = "https://api.opendota.com/api/"
+    #add api_key to params
+    params = dict(params, api_key=secrets.API_KEY)
+
+    #request
+    text = await http_get_async(base_url+category, params)
+    rst_dict = json.loads(text)
+    #save to cache in a worker thread, off the loop
+    await asyncio.get_running_loop().run_in_executor(None, cache_set, cache_key, rst_dict)
+
+    return rst_dict
+
+def get_data(category, params, force=False):
+    '''Obtain API data from OpenDota API,
+    the cache is checked in the calling thread
+    and only a miss goes to the fetch loop
+    
+    Parameters
+    ----------
+    category: string
+        A piece of url after the base url for the search category
+    params: dict
+        a dictionary of parameters without API_KEY
+    force: bool
+        skip the cache lookup and fetch, the result still replaces the cached one
+    
+    Returns
+    -------
+    dict
+        a converted API return from Dota2 API
+    '''
+    return get_data_stored(category, params, force)[0]
+
+def get_data_stored(category, params, force=False):
+    '''get_data that also tells whether the return came from the cache
+    
+    Parameters
+    ----------
+    category: string
+        A piece of url after the base url for the search category
+    params: dict
+        a dictionary of parameters without API_KEY
+    force: bool
+        skip the cache lookup and fetch, the result still replaces the cached one
+    
+    Returns
+    -------
+    tuple
+        the converted API return and the epoch time the cached one was fetched,
+        None as time when it was fetched upstream by this call
+    '''
+    #check cache
+    cache_key = construct_unique_key(category, params)
+    if not force:
+        (cached, stored_at) = cache_lookup(cache_key)
+        if cached is not None:
+            print(f"Using cache {cache_key}")
+            return (cached, stored_at)
+    return (run_async(fetch_coalesced(category, params, cache_key)), None)
+
+def get_all_data(categories, limit):
+    '''Obtain API data of many categories at once on the fetch loop
+    
+    Parameters
+    ----------
+    categories: list
+        url pieces after the base url, requested without params
+    limit: int
+        most requests in flight at a time
+    
+    Returns
+    -------
+    list
+        the converted API returns, in the same order as categories
+    '''
+    async def gather():
+        semaphore = asyncio.Semaphore(limit)
+        async def fetch(category):
+            async with semaphore:
+                return await get_data_async(category, {})
+        return await asyncio.gather(*[fetch(category) for category in categories])
+    return run_async(gather())
+
+def iter_json_array(chunks):
+    '''parse a JSON array of objects incrementally,
+    each element is yielded as soon as its text has arrived
+    
+    Parameters
+    ----------
+    chunks: iterable
+        the document as a sequence of byte strings
+    
+    Returns
+    -------
+    generator
+        the elements of the array
+    '''
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buf = ""
+    pos = 0
+    started = False
+    done = False
+    while True:
+        #skip separators, then try to decode the next element from the buffer
+        while pos < len(buf) and (buf[pos].isspace() or (started and buf[pos] == ",")):
+            pos += 1
+        if pos < len(buf):
+            if not started:
+                if buf[pos] != "[":
+                    raise ValueError("payload is not a JSON array")
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == "]":
+                return
+            try:
+                (element, end) = decoder.raw_decode(buf, pos)
+                yield element
+                pos = end
+                continue
+            except json.JSONDecodeError:
+                #element not complete yet
+                if done:
+                    raise
+        elif done:
+            raise ValueError("payload ended before the JSON array was closed")
+        #read more, dropping the parsed text
+        chunk = next(chunks, None)
+        buf = buf[pos:]
+        pos = 0
+        if chunk is None:
+            buf += text_decoder.decode(b"", final=True)
+            done = True
+        else:
+            buf += text_decoder.decode(chunk)
+
+def batched(iterable, size):
+    '''split an iterable into lists of up to size items
+    
+    Parameters
+    ----------
+    iterable: iterable
+        the items
+    size: int
+        items per batch
+    
+    Returns
+    -------
+    generator
+        the batches, in order
+    '''
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if batch == []:
+            return
+        yield batch
+
+def payload_path(cache_key):
+    '''file a downloaded payload is kept in
+    
+    Parameters
+    ----------
+    cache_key: string
+        key built by construct_unique_key
+    
+    Returns
+    -------
+    string
+        path of the gzip compressed payload under PAYLOAD_DIR
+    '''
+    return os.path.join(PAYLOAD_DIR, hashlib.sha1(cache_key.encode("utf-8")).hexdigest() + ".json.gz")
+
+def fetch_payload(category, params):
+    '''Obtain a JSON array from OpenDota API into a payload file,
+    the response is copied compressed to the file as it arrives
+    and the cache entry only holds the path of that file
+    
+    Parameters
+    ----------
+    category: string
+        A piece of url after the base url for the search category
+    params: dict
+        a dictionary of parameters without API_KEY
+    
+    Returns
+    -------
+    string
+        path of the completely downloaded payload file
+    '''
+    base_url = "https://api.opendota.com/api/"
+    #check cache, entries cached inline before payload files are fetched again
+    cache_key = construct_unique_key(category, params)
+    cached = cache_get(cache_key)
+    if isinstance(cached, dict) and os.path.exists(cached["payload"]):
+        print(f"Using cache {cache_key}")
+        return cached["payload"]
+    #if not in cache
+    print(f"Fetching {cache_key}")
+    params = dict(params, api_key=secrets.API_KEY)
+    delay = rate_limit_delay(urlparse(base_url).hostname)
+    if delay > 0:
+        time.sleep(delay)
+    path = payload_path(cache_key)
+    os.makedirs(PAYLOAD_DIR, exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    response = get_session().get(base_url+category, params=params, timeout=HTTP_TIMEOUT, stream=True)
+    try:
+        response.raise_for_status()
+        with gzip.open(tmp_path, "wb") as fw:
+            for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                fw.write(chunk)
+        #only a completely downloaded payload replaces the cached one
+        os.replace(tmp_path, path)
+    finally:
+        response.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    cache_set(cache_key, {"payload": path})
+    return path
+
+def iter_payload(path):
+    '''parse a payload file from fetch_payload element by element
+    
+    Parameters
+    ----------
+    path: string
+        path of the gzip compressed payload
+    
+    Returns
+    -------
+    generator
+        the elements of the array
+    '''
+    with gzip.open(path, "rb") as fr:
+        yield from iter_json_array(iter(lambda: fr.read(STREAM_CHUNK_SIZE), b""))
 
-def construct_DB_ProPlayers():
+def construct_DB_ProPlayers(conn, table="ProPlayers"):
     '''Create .Dota2_api sqlite file
     and construct ProPlayers table
     
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        connection of the load, from bulk_load_connection
+    table: string
+        name of the table, the shadow table during a rebuild
+    
+    Returns
+    -------
+    N/A
+    '''
+    cur = conn.cursor()
+    drop_ProPlayers=f'''
+        DROP TABLE IF EXISTS "{table}";
+    '''
+    create_ProPlayers=f'''
+        CREATE TABLE IF NOT EXISTS "{table}"(
+            "Id"            INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE,
+            "account_id"    INTEGER NOT NULL,
+            "steamid"       STRING NOT NULL,
+            "profileurl"    STRING NOT NULL,
+            "personaname"   STRING NOT NULL,
+            "name"          STRING NOT NULL,
+            "country_code"  STRING NOT NULL,
+            "fantasy_role"  INTEGER NOT NULL,
+            "team_id"       INTEGER NOT NULL,
+            "team_name"     STRING,
+            "team_tag"      STRING,
+            "is_pro"        INTEGER
+        );
+    '''
+    cur.execute(drop_ProPlayers)
+    cur.execute(create_ProPlayers)
+
+def construct_DB_ActiveProPlayers(conn, table="ActiveProPlayers"):
+    '''Create .Dota2_api sqlite file
+    and construct ActiveProPlayers table
+    
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        connection of the load, from bulk_load_connection
+    table: string
+        name of the table, the shadow table during a rebuild
+    
+    Returns
+    -------
+    N/A
+    '''
+    cur = conn.cursor()
+    drop_ActiveProPlayers=f'''
+        DROP TABLE IF EXISTS "{table}";
+    '''
+    #the ProPlayers_table_id links to player detail in ProPlayers table
+    create_ActiveProPlayers=f'''
+        CREATE TABLE IF NOT EXISTS "{table}"(
+            "Id"                INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE,
+            "player_name"       STRING,
+            "team_name"         STRING,
+            "region"            STRING,
+            "ProPlayers_table_id" INTEGER NOT NULL
+        );
+    '''
+    cur.execute(drop_ActiveProPlayers)
+    cur.execute(create_ActiveProPlayers)
+
+def construct_DB_PlayerMatches(conn):
+    '''Create .Dota2_api sqlite file
+    and construct PlayerMatches table if it does not exist,
+    matches of every looked up player accumulate in it
+    
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        a writable connection
+    
+    Returns
+    -------
+    N/A
+    '''
+    cur = conn.cursor()
+    #one row per (account_id, match_id), its index also serves the per-player lookups
+    create_PlayerMatches='''
+        CREATE TABLE IF NOT EXISTS "PlayerMatches"(
+            "Id"            INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE,
+            "account_id"    INTEGER NOT NULL,
+            "match_id"      INTEGER,
+            "win"           INTEGER,
+            "duration"      STRING,
+            "hero_id"       INTEGER NOT NULL,
+            "start_time"    STRING,
+            "kills"         INTEGER NOT NULL,
+            "deaths"        INTEGER NOT NULL,
+            "assists"       INTEGER NOT NULL,
+            "start_epoch"   INTEGER,
+            UNIQUE("account_id", "match_id")
+        );
+    '''
+    cur.execute(create_PlayerMatches)
+
+def construct_DB_DatasetRefresh(conn):
+    '''Create .Dota2_api sqlite file
+    and construct DatasetRefresh table if it does not exist,
+    it keeps when each dataset was last refreshed
+    
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        a writable connection
+    
+    Returns
+    -------
+    N/A
+    '''
+    cur = conn.cursor()
+    create_DatasetRefresh='''
+        CREATE TABLE IF NOT EXISTS "DatasetRefresh"(
+            "name"          TEXT PRIMARY KEY,
+            "refreshed_at"  REAL NOT NULL,
+            "changed"       INTEGER NOT NULL
+        );
+    '''
+    cur.execute(create_DatasetRefresh)
+
+def construct_DB_PlayerFetches(conn):
+    '''Create .Dota2_api sqlite file
+    and construct PlayerFetches table if it does not exist,
+    it keeps when the matches of each player were last fetched
+    
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        a writable connection
+    
     Returns
     -------
     N/A
     '''
-    conn = sqlite3.connect('Dota2_api.sqlite')
     cur = conn.cursor()
-    drop_ProPlayers='''
-        DROP TABLE IF EXISTS "ProPlayers";
-    '''
-    create_ProPlayers='''
-        CREATE TABLE IF NOT EXISTS "ProPlayers"(
-            "Id"            INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE,
-            "account_id"    INTEGER NOT NULL,
-            "steamid"       STRING NOT NULL,
-            "profileurl"    STRING NOT NULL,
-            "personaname"   STRING NOT NULL,
-            "name"          STRING NOT NULL,
-            "country_code"  STRING NOT NULL,
-            "fantasy_role"  INTEGER NOT NULL,
-            "team_id"       INTEGER NOT NULL,
-            "team_name"     STRING,
-            "team_tag"      STRING,
-            "is_pro"        INTEGER
+    create_PlayerFetches='''
+        CREATE TABLE IF NOT EXISTS "PlayerFetches"(
+            "account_id"    INTEGER PRIMARY KEY,
+            "fetched_at"    REAL NOT NULL
         );
     '''
-    cur.execute(drop_ProPlayers)
-    cur.execute(create_ProPlayers)
+    cur.execute(create_PlayerFetches)
 
-def construct_DB_ActiveProPlayers():
+def construct_DB_PlayerSearch(conn):
     '''Create .Dota2_api sqlite file
-    and construct ActiveProPlayers table
+    and construct PlayerSearch table and its trigram index if they do not exist,
+    they hold pro players and every player seen in a search
+    
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        a writable connection
     
     Returns
     -------
     N/A
     '''
-    conn = sqlite3.connect('Dota2_api.sqlite')
     cur = conn.cursor()
-    drop_ActiveProPlayers='''
-        DROP TABLE IF EXISTS "ActiveProPlayers";
-    '''
-    #the ProPlayers_table_id links to player detail in ProPlayers table
-    create_ActiveProPlayers='''
-        CREATE TABLE IF NOT EXISTS "ActiveProPlayers"(
-            "Id"                INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE,
-            "player_name"       STRING,
-            "team_name"         STRING,
-            "region"            STRING,
-            "ProPlayers_table_id" INTEGER NOT NULL
+    #the _key columns are the names lowered by python, which also lowers non-ASCII letters
+    create_PlayerSearch='''
+        CREATE TABLE IF NOT EXISTS "PlayerSearch"(
+            "account_id"        INTEGER PRIMARY KEY,
+            "personaname"       TEXT,
+            "name"              TEXT,
+            "personaname_key"   TEXT,
+            "name_key"          TEXT,
+            "last_match_time"   TEXT
         );
     '''
-    cur.execute(drop_ActiveProPlayers)
-    cur.execute(create_ActiveProPlayers)
+    cur.execute(create_PlayerSearch)
+    cur.execute('CREATE INDEX IF NOT EXISTS "PlayerSearch_personaname_key" ON "PlayerSearch"("personaname_key")')
+    cur.execute('CREATE INDEX IF NOT EXISTS "PlayerSearch_name_key" ON "PlayerSearch"("name_key")')
+    #rowid is the account_id, fuzzy matches fall back to a scan when trigram FTS5 is missing
+    try:
+        cur.execute('CREATE VIRTUAL TABLE IF NOT EXISTS "PlayerSearchTrigrams" USING fts5(keys, tokenize="trigram")')
+    except sqlite3.OperationalError as e:
+        print(f"No trigram index for player search: {e}")
 
-def construct_DB_PlayerMatches():
+def construct_DB_TeamRosters(conn):
     '''Create .Dota2_api sqlite file
-    and construct PlayerMatches table
+    and construct TeamRosters table if it does not exist,
+    the players of ActiveProPlayers joined with their account ids
+    
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        a writable connection
     
     Returns
     -------
     N/A
     '''
-    conn = sqlite3.connect('Dota2_api.sqlite')
     cur = conn.cursor()
-    drop_PlayerMatches='''
-        DROP TABLE IF EXISTS "PlayerMatches";
-    '''
-    create_PlayerMatches='''
-        CREATE TABLE IF NOT EXISTS "PlayerMatches"(
-            "Id"            INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE,
-            "account_id"    INTEGER NOT NULL,
-            "match_id"      INTEGER,
-            "win"           INTEGER,
-            "duration"      STRING,
-            "hero_id"       INTEGER NOT NULL,
-            "start_time"    STRING,
-            "kills"         INTEGER NOT NULL,
-            "deaths"        INTEGER NOT NULL,
-            "assists"       INTEGER NOT NULL
+    #position keeps the order the teams and players were scraped in
+    create_TeamRosters='''
+        CREATE TABLE IF NOT EXISTS "TeamRosters"(
+            "position"      INTEGER PRIMARY KEY,
+            "region"        TEXT,
+            "team_name"     TEXT,
+            "player_name"   TEXT,
+            "account_id"    INTEGER
         );
     '''
-    cur.execute(drop_PlayerMatches)
-    cur.execute(create_PlayerMatches)
-    conn.commit()
+    cur.execute(create_TeamRosters)
 
-def construct_DB_Heroes():
+def construct_DB_Heroes(conn, table="Heroes"):
     '''Create .Dota2_api sqlite file
     and construct Heroes table
     
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        connection of the load, from bulk_load_connection
+    table: string
+        name of the table, the shadow table during a rebuild
+    
     Returns
     -------
     N/A
     '''
-    conn = sqlite3.connect('Dota2_api.sqlite')
     cur = conn.cursor()
-    drop_Heroes='''
-        DROP TABLE IF EXISTS "Heroes";
+    drop_Heroes=f'''
+        DROP TABLE IF EXISTS "{table}";
     '''
-    create_Heroes='''
-        CREATE TABLE IF NOT EXISTS "Heroes"(
+    create_Heroes=f'''
+        CREATE TABLE IF NOT EXISTS "{table}"(
             "Id"            INTEGER PRIMARY KEY UNIQUE,
             "name"          STRING NOT NULL,
             "img_link"      STRING,
@@ -577,120 +2574,342 @@ def construct_DB_Heroes():
     '''
     cur.execute(drop_Heroes)
     cur.execute(create_Heroes)
-    conn.commit()
 
-def add_DB_ProPlayers(player_dict):
-    '''insert Pro Player entry to ProPlayers table
+def ProPlayers_row(player_dict):
+    '''convert a Pro Player dict from API to a ProPlayers table entry
     
     Parameters
     ----------
-    params: player_dict
+    player_dict: dict
         a dictionary of Pro player informations
     
     Returns
     -------
-    N/A
-    '''
-    conn = sqlite3.connect('Dota2_api.sqlite')
-    cur = conn.cursor()
-    insert_Players = '''
-        INSERT INTO ProPlayers
-        VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    list
+        values for the ProPlayers columns after Id
     '''
-    if len(player_dict) == 0:
-        #empty input dictinory, return
-        return
-        
     is_pro = "0"
     if player_dict["is_pro"]:
         is_pro = "1"
-    
-    player = [str(player_dict["account_id"]),player_dict["steamid"],player_dict["profileurl"],player_dict["personaname"],player_dict["name"],player_dict["country_code"],str(player_dict["fantasy_role"]),str(player_dict["team_id"]),player_dict["team_name"],player_dict["team_tag"],is_pro]
+    return [str(player_dict["account_id"]),player_dict["steamid"],player_dict["profileurl"],player_dict["personaname"],player_dict["name"],player_dict["country_code"],str(player_dict["fantasy_role"]),str(player_dict["team_id"]),player_dict["team_name"],player_dict["team_tag"],is_pro]
 
-    cur.execute(insert_Players, player)
-    conn.commit()
+def add_DB_ProPlayers(player_list, conn, table="ProPlayers"):
+    '''insert Pro Player entries to ProPlayers table
+    
+    Parameters
+    ----------
+    player_list: list
+        a list of Pro player dictionaries
+    conn: sqlite3.Connection
+        connection of the load, from bulk_load_connection
+    table: string
+        name of the table, the shadow table during a rebuild
+    
+    Returns
+    -------
+    N/A
+    '''
+    insert_Players = f'''
+        INSERT INTO "{table}"
+        VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+    #skip empty input dictinories
+    rows = [ProPlayers_row(player_dict) for player_dict in player_list if len(player_dict) != 0]
+    conn.executemany(insert_Players, rows)
 
-def add_DB_ActiveProPlayers(player_list):
+def add_DB_ActiveProPlayers(player_list, conn, table="ActiveProPlayers"):
     '''insert team entries to ActiveProPlayers table
     
     Parameters
     ----------
-    params: player_list
+    player_list: list
         A list contains ActiveProPlayers table entries
+    conn: sqlite3.Connection
+        connection of the load, from bulk_load_connection
+    table: string
+        name of the table, the shadow table during a rebuild
     
     Returns
     -------
     N/A
     '''
-    conn = sqlite3.connect('Dota2_api.sqlite')
-    cur = conn.cursor()
-    insert_players = '''
-        INSERT INTO ActiveProPlayers
+    insert_players = f'''
+        INSERT INTO "{table}"
         VALUES (NULL, ?, ?, ?, ?)
     '''
-    if len(player_list) == 0:
-        #empty input dictinory, return
-        return
+    conn.executemany(insert_players, player_list)
+
+def add_DB_PlayerMatches(match_list, conn):
+    '''insert or update match entries of PlayerMatches table
+    
+    Parameters
+    ----------
+    match_list: list
+        A list contains PlayerMatches table entries
+    conn: sqlite3.Connection
+        a writable connection
+    
+    Returns
+    -------
+    N/A
+    '''
+    upsert_matches = '''
+        INSERT INTO PlayerMatches
+        VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(account_id, match_id) DO UPDATE SET
+            win = excluded.win,
+            duration = excluded.duration,
+            hero_id = excluded.hero_id,
+            start_time = excluded.start_time,
+            kills = excluded.kills,
+            deaths = excluded.deaths,
+            assists = excluded.assists,
+            start_epoch = excluded.start_epoch
+    '''
+    conn.executemany(upsert_matches, match_list)
+
+def add_DB_Heroes(hero_list, conn, table="Heroes"):
+    '''insert hero entries to Heroes table
+    
+    Parameters
+    ----------
+    hero_list: list
+        A list contains Heroes table entries
+    conn: sqlite3.Connection
+        connection of the load, from bulk_load_connection
+    table: string
+        name of the table, the shadow table during a rebuild
+    
+    Returns
+    -------
+    N/A
+    '''
+    insert_heroes = f'''
+        INSERT INTO "{table}"
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+    conn.executemany(insert_heroes, hero_list)
+
+def bulk_load_connection():
+    '''open a connection tuned for rebuilding a table,
+    the caller runs the whole rebuild as one transaction
     
-    for player in player_list:
-        cur.execute(insert_players, player)
+    Returns
+    -------
+    sqlite3.Connection
+        connection to Dota2_api.sqlite with a transaction started
+    '''
+    conn = open_db_connection(False)
+    #a failed load rolls back and is rerun from the cache, so skip fsyncs while loading
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-65536")
+    conn.execute("BEGIN")
+    return conn
 
+def finish_bulk_load(conn, table):
+    '''index the rebuilt table, commit the rebuild started by
+    bulk_load_connection and close it
+    
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        connection from bulk_load_connection
+    table: string
+        name of the rebuilt table
+    
+    Returns
+    -------
+    N/A
+    '''
+    #indexing after the inserts is cheaper than keeping the index up to date row by row
+    create_DB_indexes(conn, table)
     conn.commit()
+    close_db_connection(conn)
 
-def add_DB_PlayerMatches(match_list):
-    '''insert team entries to ActiveProPlayers table
+@contextmanager
+def bulk_load(table):
+    '''rebuild a table in one bulk load transaction, committed by
+    finish_bulk_load on success, rolled back and closed on failure
     
     Parameters
     ----------
-    params: player_list
-        A list contains ActiveProPlayers table entries
+    table: string
+        name of the rebuilt table
+    
+    Returns
+    -------
+    sqlite3.Connection
+        connection from bulk_load_connection
+    '''
+    conn = bulk_load_connection()
+    try:
+        yield conn
+    except:
+        conn.rollback()
+        close_db_connection(conn)
+        raise
+    finish_bulk_load(conn, table)
+
+def create_DB_indexes(conn, table):
+    '''create the DB_INDEXES of a table
+    
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        a writable connection
+    table: string
+        name of the table
     
     Returns
     -------
     N/A
     '''
-    conn = sqlite3.connect('Dota2_api.sqlite')
-    cur = conn.cursor()
-    insert_matches = '''
-        INSERT INTO PlayerMatches
-        VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    for create_index in DB_INDEXES.get(table, []):
+        conn.execute(create_index)
+
+def migrate_DB_indexes(conn):
+    '''schema version 1: add DB_INDEXES to the tables of an existing database
+    
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        a writable connection inside the migration transaction
+    
+    Returns
+    -------
+    N/A
     '''
-    if len(match_list) == 0:
-        #empty input dictinory, return
-        return
+    tables = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+    for (table,) in tables:
+        create_DB_indexes(conn, table)
+
+def migrate_DB_PlayerMatches(conn):
+    '''schema version 2: replace the per request PlayerMatches table
+    with the persistent one keyed by (account_id, match_id)
+    
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        a writable connection inside the migration transaction
     
-    for match in match_list:
-        cur.execute(insert_matches, match)
+    Returns
+    -------
+    N/A
+    '''
+    #the old table only ever held the last looked up player, nothing worth keeping
+    conn.execute('DROP TABLE IF EXISTS "PlayerMatches"')
+    construct_DB_PlayerMatches(conn)
 
-    conn.commit()
+def migrate_DB_DatasetRefresh(conn):
+    '''schema version 3: add the DatasetRefresh table of the refresh scheduler
+    
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        a writable connection inside the migration transaction
+    
+    Returns
+    -------
+    N/A
+    '''
+    construct_DB_DatasetRefresh(conn)
 
-def add_DB_Heroes(hero_list):
-    '''insert team entries to Heroes table
+def migrate_DB_PlayerFetches(conn):
+    '''schema version 4: add the PlayerFetches table for the age of player matches
     
     Parameters
     ----------
-    params: hero_list
-        A list contains Heroes table entries
+    conn: sqlite3.Connection
+        a writable connection inside the migration transaction
     
     Returns
     -------
     N/A
     '''
-    conn = sqlite3.connect('Dota2_api.sqlite')
-    cur = conn.cursor()
-    insert_heroes = '''
-        INSERT INTO Heroes
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    construct_DB_PlayerFetches(conn)
+
+def migrate_DB_PlayerSearch(conn):
+    '''schema version 5: add the PlayerSearch index, filled from ProPlayers
+    
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        a writable connection inside the migration transaction
+    
+    Returns
+    -------
+    N/A
     '''
-    if len(hero_list) == 0:
-        #empty input dictinory, return
-        return
-    for hero in hero_list:
-        cur.execute(insert_heroes, hero)
+    construct_DB_PlayerSearch(conn)
+    if conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'ProPlayers'").fetchone()[0]:
+        index_pro_players(conn)
 
-    conn.commit()
+def migrate_DB_TeamRosters(conn):
+    '''schema version 6: add the TeamRosters table, built from the current teams
+    
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        a writable connection inside the migration transaction
+    
+    Returns
+    -------
+    N/A
+    '''
+    construct_DB_TeamRosters(conn)
+    query = "SELECT COUNT(*) FROM sqlite_master WHERE name IN ('ProPlayers', 'ActiveProPlayers')"
+    if conn.execute(query).fetchone()[0] == 2:
+        store_TeamRosters(conn)
+
+def migrate_DB_drop_team_name_index(conn):
+    '''schema version 7: drop the ProPlayers team name index,
+    ActiveProPlayers_helper matches teams in memory now
+    
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        a writable connection inside the migration transaction
+    
+    Returns
+    -------
+    N/A
+    '''
+    conn.execute('DROP INDEX IF EXISTS "ProPlayers_team_name_lower"')
+
+#schema upgrades, DB_MIGRATIONS[n] brings a database from user_version n to n+1
+DB_MIGRATIONS = [
+    migrate_DB_indexes,
+    migrate_DB_PlayerMatches,
+    migrate_DB_DatasetRefresh,
+    migrate_DB_PlayerFetches,
+    migrate_DB_PlayerSearch,
+    migrate_DB_TeamRosters,
+    migrate_DB_drop_team_name_index,
+]
+
+def migrate_DB():
+    '''upgrade Dota2_api.sqlite in place to the latest schema version,
+    the version is kept in PRAGMA user_version
+    
+    Returns
+    -------
+    int
+        the schema version after the upgrade
+    '''
+    conn = open_db_connection(False)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    while version < len(DB_MIGRATIONS):
+        print(f"Migrating database to schema version {version+1}")
+        conn.execute("BEGIN")
+        DB_MIGRATIONS[version](conn)
+        version += 1
+        conn.execute(f"PRAGMA user_version = {version}")
+        conn.commit()
+    close_db_connection(conn)
+    return version
 
-def ActiveProPlayers_helper(team_dict):
+def ActiveProPlayers_helper(team_dict, ProPlayers_table="ProPlayers"):
     ''' accept team_dict as input, 
         search ProPlayer table for players of that team,
         construct a new list for feeding the ActiveProPlayers table
@@ -699,42 +2918,37 @@ def ActiveProPlayers_helper(team_dict):
     ----------
     params: team_dict
         A dict of team lists under region keys
+    ProPlayers_table: string
+        the ProPlayers table to search, its shadow table while both are rebuilt
     
     Returns
     -------
     list
         A list of (Proplayer_name, team_name, region, table_id) tuples
     '''
-    #dict for alternate name of a team
-    alias_dict = {"omega gaming":"Ωmega gaming"}
-    conn = sqlite3.connect('Dota2_api.sqlite')
-    cur = conn.cursor()
+    #index players by lowered team name in one pass,
+    #python lowers non-ASCII letters too, unlike sqlite LOWER
+    query = f'''  SELECT  name, Id, team_name
+                FROM    "{ProPlayers_table}"
+            '''
+    team_index = {}
+    for (name, table_id, team) in DB_query(query):
+        if team is not None:
+            team_index.setdefault(str(team).lower(), []).append((name, table_id))
     ActiveProPlayers_list = []
     region_list = list(team_dict.keys())
     #get region and team_name
     for region in region_list:
         for team_name in team_dict[region]:
             #search entries match the team name in ProPlayers table
-            query = f'''  SELECT  name, Id
-                        FROM    ProPlayers
-                        WHERE   (LOWER(team_name) = '{team_name.lower()}')
-                    '''
-            result = cur.execute(query).fetchall()
+            result = team_index.get(team_name.lower(), [])
             #if cannot find, try again without "Team "
             if (result == []):
                 team_name = team_name.split("Team ")[-1]
-                query = f'''  SELECT  name, Id
-                        FROM    ProPlayers
-                        WHERE   (LOWER(team_name) = '{team_name.lower()}')
-                        '''
-                result = cur.execute(query).fetchall()
+                result = team_index.get(team_name.lower(), [])
             #if still cannot find, check alternate names
-            if (result == [] and team_name.lower() in alias_dict.keys()):
-                query = f'''  SELECT  name, Id
-                        FROM    ProPlayers
-                        WHERE   (LOWER(team_name) = '{alias_dict[team_name.lower()]}')
-                        '''
-                result = cur.execute(query).fetchall()
+            if (result == [] and team_name.lower() in TEAM_ALIASES):
+                result = team_index.get(TEAM_ALIASES[team_name.lower()].lower(), [])
             #insert into list
             for (name, table_id) in result:
                 ActiveProPlayers_list.append((name, team_name, region, table_id))
@@ -742,6 +2956,8 @@ def ActiveProPlayers_helper(team_dict):
 
 def get_n_store_ProPlayers():
     '''Construct ProPlayers table, API get ProPlayers data, Store in table
+        ActiveProPlayers links to ProPlayers ids, so it is rebuilt along
+        and both are swapped in together
     
     Parameters
     ----------
@@ -751,31 +2967,187 @@ def get_n_store_ProPlayers():
     -------
     N/A
     '''
-    construct_DB_ProPlayers()
-    #get all pro players data
+    #get all pro players data, downloaded before the load transaction opens
     category = "ProPlayers"
     params = {}
-    rst_dict = get_data(category, params)
-    for entry in rst_dict:
-        add_DB_ProPlayers(entry)
+    path = fetch_payload(category, params)
+    shadow = shadow_table("ProPlayers")
+    with bulk_load(shadow) as conn:
+        construct_DB_ProPlayers(conn, shadow)
+        for player_list in batched(iter_payload(path), PROPLAYERS_BATCH):
+            add_DB_ProPlayers(player_list, conn, shadow)
+    store_ActiveProPlayers(shadow)
+    swap_DB_tables(["ProPlayers", "ActiveProPlayers"])
+    rebuild_team_rosters()
+    with db_connection(readonly=False) as conn:
+        index_pro_players(conn)
+        conn.commit()
+
+def shadow_table(table):
+    '''name of the table a rebuild is loaded into before it is swapped in
+    
+    Parameters
+    ----------
+    table: string
+        name of the live table
+    
+    Returns
+    -------
+    string
+        name of its shadow table
+    '''
+    return table + "_new"
+
+def swap_DB_tables(tables):
+    '''replace live tables by their shadow tables in one transaction,
+    readers keep seeing the old tables until it commits
+    
+    Parameters
+    ----------
+    tables: list
+        names of the live tables
+    
+    Returns
+    -------
+    N/A
+    '''
+    conn = open_db_connection(False)
+    conn.execute("BEGIN IMMEDIATE")
+    for table in tables:
+        conn.execute(f'DROP TABLE IF EXISTS "{table}"')
+        conn.execute(f'ALTER TABLE "{shadow_table(table)}" RENAME TO "{table}"')
+        create_DB_indexes(conn, table)
+    conn.commit()
+    close_db_connection(conn)
+
+def open_db_connection(readonly):
+    '''open a new connection to the database
+    
+    Parameters
+    ----------
+    readonly: bool
+        open the database read-only, as request handlers do
+    
+    Returns
+    -------
+    sqlite3.Connection
+        the new connection
+    '''
+    if readonly:
+        conn = sqlite3.connect(f"file:{DB_FILENAME}?mode=ro", uri=True, timeout=30,
+                               check_same_thread=False, cached_statements=DB_STATEMENT_CACHE)
+    else:
+        conn = sqlite3.connect(DB_FILENAME, timeout=30,
+                               check_same_thread=False, cached_statements=DB_STATEMENT_CACHE)
+        #WAL lets the read-only connections keep reading while this one writes
+        conn.execute("PRAGMA journal_mode=WAL")
+    with DB_STATS_LOCK:
+        DB_STATS["open"] += 1
+        DB_STATS["opened"] += 1
+    return conn
+
+def close_db_connection(conn):
+    '''close a connection opened by open_db_connection
+    
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        the connection to close
+    
+    Returns
+    -------
+    N/A
+    '''
+    conn.close()
+    with DB_STATS_LOCK:
+        DB_STATS["open"] -= 1
+
+@contextmanager
+def db_connection(readonly=True):
+    '''borrow a pooled connection, it goes back to the pool afterwards
+    so its prepared statements are reused by the next caller
+    
+    Parameters
+    ----------
+    readonly: bool
+        borrow a read-only connection
+    
+    Returns
+    -------
+    sqlite3.Connection
+        the borrowed connection
+    '''
+    pool = DB_POOLS[readonly]
+    try:
+        conn = pool.get_nowait()
+    except queue.Empty:
+        conn = open_db_connection(readonly)
+    try:
+        yield conn
+    except:
+        conn.rollback()
+        raise
+    finally:
+        if pool.qsize() < DB_POOL_SIZE:
+            pool.put(conn)
+        else:
+            close_db_connection(conn)
+
+def close_db_connections():
+    '''close every idle pooled connection, called at shutdown
+    
+    Returns
+    -------
+    N/A
+    '''
+    for pool in DB_POOLS.values():
+        while True:
+            try:
+                conn = pool.get_nowait()
+            except queue.Empty:
+                break
+            close_db_connection(conn)
 
-def DB_query(query):
+atexit.register(close_db_connections)
+
+def db_stats():
+    '''snapshot of the connection and query latency counters
+    
+    Returns
+    -------
+    dict
+        connection counts and query timings
+    '''
+    with DB_STATS_LOCK:
+        stats = dict(DB_STATS)
+    stats["idle"] = DB_POOLS[True].qsize() + DB_POOLS[False].qsize()
+    if stats["queries"] > 0:
+        stats["mean_query_seconds"] = stats["query_seconds"] / stats["queries"]
+    return stats
+
+def DB_query(query, params=()):
     '''A helper function to get data from Dota2_api.sqlite
     
     Parameters
     ----------
     query: String
         A command string pass to database from data query
+    params: tuple
+        values bound to the ? placeholders of the query
     
     Returns
     -------
     list
         a list of tuples that represent the query result
     '''
-    connection = sqlite3.connect("Dota2_api.sqlite")
-    cursor = connection.cursor()
-    result = cursor.execute(query).fetchall()
-    connection.close()
+    start = time.perf_counter()
+    with db_connection() as connection:
+        result = connection.execute(query, params).fetchall()
+    elapsed = time.perf_counter() - start
+    with DB_STATS_LOCK:
+        DB_STATS["queries"] += 1
+        DB_STATS["query_seconds"] += elapsed
+        DB_STATS["slowest_query_seconds"] = max(DB_STATS["slowest_query_seconds"], elapsed)
     return result
     
 def get_active_teams():
@@ -792,16 +3164,16 @@ def get_active_teams():
     '''
     url = "https://liquipedia.net/dota2/Portal:Teams"
     active_teams = {}
-    cache = open_cache()
     #check cache
     cache_key = construct_unique_key("active_teams", {})
-    if(cache_key in cache):
+    cached = cache_get(cache_key)
+    if cached is not None:
         print(f"Using cache {cache_key}")
-        return cache[cache_key]
+        return cached
     #if not in cache
     print(f"Fetching {cache_key}")
     #request
-    response = requests.get(url)
+    response = http_get(url)
     #parse it with bs
     soup = BeautifulSoup(response.content, "html.parser")
     #get to the lists of teams
@@ -825,13 +3197,74 @@ def get_active_teams():
         active_teams[region_name] = region_team
         
     #save to cache
-    cache[cache_key] = active_teams
-    save_cache(cache)
+    cache_set(cache_key, active_teams)
+
+    return active_teams
+
+def get_n_store_ActiveProPlayers():
+    '''get active teams from HTML and store to DB
+    
+    Parameters
+    ----------
+    N/A
+    
+    Returns
+    -------
+    N/A
+    '''
+    store_ActiveProPlayers("ProPlayers")
+    swap_DB_tables(["ActiveProPlayers"])
+    rebuild_team_rosters()
 
-    return active_teams
+def store_ActiveProPlayers(ProPlayers_table):
+    '''get active teams from HTML and store them to the
+    ActiveProPlayers shadow table
+    
+    Parameters
+    ----------
+    ProPlayers_table: string
+        the ProPlayers table the entries link to
+    
+    Returns
+    -------
+    N/A
+    '''
+    team_dict = get_active_teams()
+    ActiveProPlayers_list = ActiveProPlayers_helper(team_dict, ProPlayers_table)
+    shadow = shadow_table("ActiveProPlayers")
+    with bulk_load(shadow) as conn:
+        construct_DB_ActiveProPlayers(conn, shadow)
+        add_DB_ActiveProPlayers(ActiveProPlayers_list, conn, shadow)
 
-def get_n_store_ActiveProPlayers():
-    '''get active teams from HTML and store to DB
+def store_TeamRosters(conn):
+    '''rebuild TeamRosters from ActiveProPlayers and ProPlayers
+    
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        a writable connection, the caller commits
+    
+    Returns
+    -------
+    N/A
+    '''
+    insert_rosters = '''
+        INSERT INTO TeamRosters
+        SELECT  ActiveProPlayers.Id,
+                ActiveProPlayers.region,
+                ActiveProPlayers.team_name,
+                ActiveProPlayers.player_name,
+                ProPlayers.account_id
+        FROM    ActiveProPlayers
+                INNER JOIN ProPlayers
+                ON ActiveProPlayers.ProPlayers_table_id = ProPlayers.Id
+    '''
+    conn.execute("DELETE FROM TeamRosters")
+    conn.execute(insert_rosters)
+
+def rebuild_team_rosters():
+    '''rebuild TeamRosters and reload the in-memory rosters,
+    called whenever ActiveProPlayers changes
     
     Parameters
     ----------
@@ -841,34 +3274,120 @@ def get_n_store_ActiveProPlayers():
     -------
     N/A
     '''
-    construct_DB_ActiveProPlayers()
-    team_dict = get_active_teams()
-    ActiveProPlayers_list = ActiveProPlayers_helper(team_dict)
-    add_DB_ActiveProPlayers(ActiveProPlayers_list)
+    with db_connection(readonly=False) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        store_TeamRosters(conn)
+        conn.commit()
+    load_team_rosters(refresh=True)
 
-def get_n_store_recent_matches(account_id):
+def get_n_store_recent_matches(account_id, force=False):
     '''Obtain recent 10 matches of a player from OpenDota API.
         process them and store in the thde PlayerMatches table.
+        once a player has stored matches only the days since the newest one are fetched
     
     Parameters
     ----------
     account_id: int
         the account id of a dota player
+    force: bool
+        skip the cached API return, for refreshes
     
     Returns
     -------
     N/A
     '''
-    #get data from api
+    #only ask for the days since the newest stored match of the player
+    query = '''
+        SELECT start_epoch
+        FROM PlayerMatches
+        WHERE account_id = ?
+        ORDER BY match_id DESC
+        LIMIT 1
+    '''
+    latest = DB_query(query, (account_id,))
     category = f"players/{account_id}/matches"
     params = {"limit":10}
-    result_list = get_data(category, params)
+    if len(latest) > 0 and latest[0][0] is not None:
+        params["date"] = max(1, math.ceil((time.time() - latest[0][0]) / 86400))
+    #get data from api
+    start = time.perf_counter()
+    try:
+        (result_list, fetched_at) = get_data_stored(category, params, force)
+    except Exception:
+        with PLAYER_REFRESH_LOCK:
+            PLAYER_FETCH_STATS["failures"] += 1
+        raise
+    elapsed = time.perf_counter() - start
+    #only upstream fetches count, a cached return keeps the time it was fetched
+    if fetched_at is None:
+        fetched_at = time.time()
+        with PLAYER_REFRESH_LOCK:
+            PLAYER_FETCH_STATS["fetches"] += 1
+            PLAYER_FETCH_STATS["seconds"] += elapsed
+            PLAYER_FETCH_STATS["slowest_seconds"] = max(PLAYER_FETCH_STATS["slowest_seconds"], elapsed)
     #parse it
     PlayerMatches_list = PlayerMatches_helper(result_list, account_id)
-    #construct DB
-    construct_DB_PlayerMatches()
-    #store into DB
-    add_DB_PlayerMatches(PlayerMatches_list)
+    #store into DB with the time of the fetch, never moved back by an older cached return
+    with db_connection(readonly=False) as conn:
+        add_DB_PlayerMatches(PlayerMatches_list, conn)
+        upsert = '''
+            INSERT INTO "PlayerFetches" VALUES (?, ?)
+            ON CONFLICT(account_id) DO UPDATE SET fetched_at = MAX(fetched_at, excluded.fetched_at)
+        '''
+        conn.execute(upsert, (account_id, fetched_at))
+        conn.commit()
+
+def player_fetched_at(account_id):
+    '''when the matches of a player were last fetched
+    
+    Parameters
+    ----------
+    account_id: int
+        the account id of a dota player
+    
+    Returns
+    -------
+    float
+        epoch seconds of the last fetch, None if never fetched
+    '''
+    result = DB_query('SELECT fetched_at FROM "PlayerFetches" WHERE account_id = ?', (account_id,))
+    if result == []:
+        return None
+    return result[0][0]
+
+def refresh_recent_matches(account_id):
+    '''refetch the matches of a player in a background thread
+    once they are older than PLAYER_FRESH_SECONDS, one refresh per player at a time
+    
+    Parameters
+    ----------
+    account_id: int
+        the account id of a dota player
+    
+    Returns
+    -------
+    bool
+        True if a refresh was started
+    '''
+    fetched_at = player_fetched_at(account_id)
+    if fetched_at is not None and time.time() - fetched_at < PLAYER_FRESH_SECONDS:
+        return False
+    key = str(account_id)
+    with PLAYER_REFRESH_LOCK:
+        if key in PLAYER_REFRESHING:
+            return False
+        PLAYER_REFRESHING.add(key)
+        PLAYER_FETCH_STATS["background"] += 1
+    def refresh():
+        try:
+            get_n_store_recent_matches(account_id, force=True)
+        except Exception as e:
+            print(f"Refreshing matches of {account_id} failed: {e}")
+        finally:
+            with PLAYER_REFRESH_LOCK:
+                PLAYER_REFRESHING.discard(key)
+    threading.Thread(target=refresh, daemon=True).start()
+    return True
 
 def PlayerMatches_helper(raw_list, account_id):
     '''convert raw match information to entries of PlayerMatches table
@@ -914,7 +3433,7 @@ def PlayerMatches_helper(raw_list, account_id):
         deaths = item["deaths"]
         assists = item["assists"]
         #insert into return list
-        return_list.append((account_id, match_id, win, duration, hero_id, start_time, kills, deaths, assists))
+        return_list.append((account_id, match_id, win, duration, hero_id, start_time, kills, deaths, assists, item["start_time"]))
 
     return  return_list
 
@@ -935,7 +3454,9 @@ def epoch_conv(stamp):
     return s + " GMT"
     
 def user_search(player_name):
-    '''search dota2 player name, return up to 10 name matches with account_id
+    '''search dota2 player name, return up to 10 name matches with account_id,
+    answered from the local PlayerSearch index when it has an exact or prefix match,
+    otherwise from the upstream search followed by the close local matches
     
     Parameters
     ----------
@@ -947,9 +3468,18 @@ def user_search(player_name):
     dict:
         dict of similar player names with their account_id and last match time
     '''
+    local_list = local_player_search(player_name, close_matches=False)
+    if local_list != []:
+        with PLAYER_SEARCH_LOCK:
+            PLAYER_SEARCH_STATS["local"] += 1
+        return local_list
+    with PLAYER_SEARCH_LOCK:
+        PLAYER_SEARCH_STATS["upstream"] += 1
     category = "search"
     params = {'q':player_name}
     result_list = get_data(category,params)
+    #remember the players for the next searches
+    remember_search_results(result_list)
     #parse it and, limit it to 10 entries
     limit = 10
     ct = 0
@@ -968,8 +3498,170 @@ def user_search(player_name):
         ct += 1
         if ct == limit:
             break
+    #fill up with close local matches the upstream search missed
+    found = {item["account_id"] for item in return_list}
+    for item in local_player_search(player_name):
+        if ct == limit:
+            break
+        if item["account_id"] not in found:
+            return_list.append(item)
+            ct += 1
 
     return return_list
+
+def index_player_trigrams(conn, account_ids=None):
+    '''write PlayerSearch names to the trigram index
+    
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        a writable connection
+    account_ids: list
+        the players to reindex, None reindexes every player
+    
+    Returns
+    -------
+    N/A
+    '''
+    select = '''
+        SELECT account_id, COALESCE(personaname_key, '') || ' ' || COALESCE(name_key, '')
+        FROM "PlayerSearch"
+    '''
+    try:
+        if account_ids is None:
+            conn.execute('DELETE FROM "PlayerSearchTrigrams"')
+            conn.execute(f'INSERT INTO "PlayerSearchTrigrams"(rowid, keys) {select}')
+            return
+        for account_id in account_ids:
+            conn.execute('DELETE FROM "PlayerSearchTrigrams" WHERE rowid = ?', (account_id,))
+            conn.execute(f'INSERT INTO "PlayerSearchTrigrams"(rowid, keys) {select} WHERE account_id = ?', (account_id,))
+    except sqlite3.OperationalError:
+        #no trigram index, see construct_DB_PlayerSearch
+        pass
+
+def index_pro_players(conn):
+    '''copy pro player names from ProPlayers to PlayerSearch,
+    players that left the pro list keep their persona name
+    
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        a writable connection
+    
+    Returns
+    -------
+    N/A
+    '''
+    pros = conn.execute('SELECT account_id, personaname, name FROM "ProPlayers"').fetchall()
+    rows = [(account_id, personaname, name, str(personaname).lower(), str(name).lower())
+            for (account_id, personaname, name) in pros]
+    upsert = '''
+        INSERT INTO "PlayerSearch"(account_id, personaname, name, personaname_key, name_key)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(account_id) DO UPDATE SET
+            personaname = excluded.personaname,
+            name = excluded.name,
+            personaname_key = excluded.personaname_key,
+            name_key = excluded.name_key
+    '''
+    conn.execute('UPDATE "PlayerSearch" SET name = NULL, name_key = NULL WHERE name IS NOT NULL')
+    conn.executemany(upsert, rows)
+    index_player_trigrams(conn)
+
+def remember_search_results(result_list):
+    '''add the players of an upstream search to PlayerSearch
+    
+    Parameters
+    ----------
+    result_list: list
+        player dicts from the OpenDota search
+    
+    Returns
+    -------
+    N/A
+    '''
+    rows = [(item["account_id"], item["personaname"], str(item["personaname"]).lower(), item.get("last_match_time"))
+            for item in result_list if item.get("personaname")]
+    upsert = '''
+        INSERT INTO "PlayerSearch"(account_id, personaname, personaname_key, last_match_time)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(account_id) DO UPDATE SET
+            personaname = excluded.personaname,
+            personaname_key = excluded.personaname_key,
+            last_match_time = COALESCE(excluded.last_match_time, last_match_time)
+    '''
+    with db_connection(readonly=False) as conn:
+        conn.executemany(upsert, rows)
+        index_player_trigrams(conn, [row[0] for row in rows])
+        conn.commit()
+
+def local_player_search(player_name, close_matches=True):
+    '''search the PlayerSearch index, exact names first,
+    then names starting with player_name, then close trigram matches
+    
+    Parameters
+    ----------
+    player_name: string
+        a string of palyer name
+    close_matches: bool
+        include the close trigram matches
+    
+    Returns
+    -------
+    list:
+        up to 10 dicts with account_id, name and last_match_time like user_search,
+        empty when there is no good local match
+    '''
+    key = player_name.strip().lower()
+    if key == "":
+        return []
+    columns = "account_id, personaname, personaname_key, name_key, last_match_time"
+    #range scans on the key indexes, short queries only match whole names
+    prefix = f'''
+        SELECT {columns} FROM "PlayerSearch" WHERE personaname_key >= ? AND personaname_key < ?
+        UNION
+        SELECT {columns} FROM "PlayerSearch" WHERE name_key >= ? AND name_key < ?
+    '''
+    fuzzy = f'''
+        SELECT {columns} FROM "PlayerSearch"
+        WHERE account_id IN (SELECT rowid FROM "PlayerSearchTrigrams" WHERE keys MATCH ? ORDER BY rank LIMIT ?)
+    '''
+    if len(key) >= PLAYER_SEARCH_MIN_PREFIX:
+        upper = key + "\U0010ffff"
+    else:
+        upper = key + "\x00"
+    try:
+        candidates = DB_query(prefix, (key, upper, key, upper))
+        if close_matches and len(key) >= 3:
+            trigrams = {key[i:i+3] for i in range(len(key) - 2)}
+            match = " OR ".join('"' + trigram.replace('"', '""') + '"' for trigram in trigrams)
+            try:
+                candidates += DB_query(fuzzy, (match, PLAYER_SEARCH_CANDIDATES))
+            except sqlite3.OperationalError:
+                #no trigram index, see construct_DB_PlayerSearch
+                pass
+    except sqlite3.OperationalError:
+        #no database file yet
+        return []
+    ranked = {}
+    for (account_id, personaname, personaname_key, name_key, last_match_time) in candidates:
+        #like user_search, searched players without a last match are skipped, pros are kept
+        if name_key is None and last_match_time is None:
+            continue
+        names = [name for name in (personaname_key, name_key) if name]
+        if key in names:
+            rank = 2
+        elif any(name.startswith(key) for name in names):
+            rank = 1
+        else:
+            rank = 0
+        ratio = max([difflib.SequenceMatcher(None, key, name).ratio() for name in names] or [0])
+        if rank == 0 and ratio < PLAYER_SEARCH_FUZZY_CUTOFF:
+            continue
+        ranked[account_id] = ((rank, ratio, last_match_time or ""), personaname)
+    best = sorted(ranked.items(), key=lambda item: item[1][0], reverse=True)[:10]
+    return [{"account_id": account_id, "name": personaname, "last_match_time": order[2] or None}
+            for (account_id, (order, personaname)) in best]
     
 def get_hero_links():
     '''get heros links from dota2 hero main HTML page
@@ -985,16 +3677,16 @@ def get_hero_links():
     '''
     #get hero info from HTML
     base_url = "https://www.dota2.com/heroes/"
-    cache = open_cache()
     #check cache
     cache_key = construct_unique_key("heroes", {})
-    if(cache_key in cache):
+    cached = cache_get(cache_key)
+    if cached is not None:
         print(f"Using cache {cache_key}")
-        return cache[cache_key]
+        return cached
     #if not in cache
     print(f"Fetching {cache_key}")
     #request
-    response = requests.get(base_url)
+    response = http_get(base_url)
     #parse it with bs
     soup = BeautifulSoup(response.content, "html.parser")
     #get hero links
@@ -1004,13 +3696,13 @@ def get_hero_links():
     for a in soup:
         hero_links.append(str(a.get("href")))
     #store to cache
-    cache[cache_key] = hero_links
-    save_cache(cache)
+    cache_set(cache_key, hero_links)
 
     return hero_links
 
 def get_hero_detail(hero_links):
-    '''get heros detail from dota2 hero HTML page
+    '''get heros detail from dota2 hero HTML page,
+    up to HERO_FETCH_WORKERS pages are fetched at once
     
     Parameters
     ----------
@@ -1020,41 +3712,53 @@ def get_hero_detail(hero_links):
     Returns
     -------
     list:
-        a list of dictionaries, contains hero name, bio and link to img
+        a list of dictionaries, contains hero name, bio and link to img,
+        in the same order as hero_links
     '''
-    return_list = []
-    for base_url in hero_links:
-        cache = open_cache()
-        #check cache
-        cache_key = construct_unique_key("Hero-"+base_url, {})
-        #if in cache, append into return list and check next one
-        if(cache_key in cache):
-            print(f"Using cache {cache_key}")
-            return_list.append(cache[cache_key])
-            continue
-        #if not in cache
-        print(f"Fetching {cache_key}")
-        #request
-        response = requests.get(base_url)
-        #parse it with bs
-        soup = BeautifulSoup(response.content, "html.parser")
-        #get hero name
-        soup = soup.find("div", id="centerColContent")
-        name = soup.find("h1").text
-        #get hero img, w/h 135/272
-        img = soup.find("img", id="heroPrimaryPortraitImg").get("src")
-        #get bio of hero
-        bio =  soup.find("div", id="bioInner").text.strip()
-        #inser to return list
-        hero_dict = {}
-        hero_dict["name"] = name
-        hero_dict["img"] = img
-        hero_dict["bio"] = bio
-        return_list.append(hero_dict)
-        #store into cache
-        cache[cache_key] = hero_dict
-        save_cache(cache)
-    return return_list
+    if HERO_FETCH_WORKERS <= 1:
+        return [fetch_hero_detail(base_url) for base_url in hero_links]
+    with ThreadPoolExecutor(max_workers=HERO_FETCH_WORKERS) as executor:
+        return list(executor.map(fetch_hero_detail, hero_links))
+
+def fetch_hero_detail(base_url):
+    '''get one hero's detail from its dota2 hero HTML page with cache
+    
+    Parameters
+    ----------
+    base_url: string
+        url to hero detail page
+    
+    Returns
+    -------
+    dict:
+        contains hero name, bio and link to img
+    '''
+    #check cache
+    cache_key = construct_unique_key("Hero-"+base_url, {})
+    cached = cache_get(cache_key)
+    if cached is not None:
+        print(f"Using cache {cache_key}")
+        return cached
+    #if not in cache
+    print(f"Fetching {cache_key}")
+    #request
+    response = http_get(base_url)
+    #parse it with bs
+    soup = BeautifulSoup(response.content, "html.parser")
+    #get hero name
+    soup = soup.find("div", id="centerColContent")
+    name = soup.find("h1").text
+    #get hero img, w/h 135/272
+    img = soup.find("img", id="heroPrimaryPortraitImg").get("src")
+    #get bio of hero
+    bio =  soup.find("div", id="bioInner").text.strip()
+    hero_dict = {}
+    hero_dict["name"] = name
+    hero_dict["img"] = img
+    hero_dict["bio"] = bio
+    #store into cache
+    cache_set(cache_key, hero_dict)
+    return hero_dict
 
 def get_hero_info_api():
     '''get hero info from API
@@ -1083,24 +3787,46 @@ def get_hero_info_api():
     #end PATCH
     return new_dict
 
-def sort_helper(matchup_dict):
-    '''a helper function for sorting matchup list
+def matchup_extremes(raw_data):
+    '''find the 3 best and 3 worst matchups of a hero,
+    only matchups with not less than 10 games are counted
     
     Parameters
     ----------
-    matchup_dict: dict
-        a dictionary has hero_id and rate
+    raw_data: list
+        matchup dicts with hero_id, games_played and wins from API
     
     Returns
     -------
-    float:
-        the win rate of matchup
+    list
+        [best_1, best_rate_1, .. best_3, best_rate_3, worst_1, worst_rate_1, .. worst_3, worst_rate_3],
+        best first and worst first, None if there are less than 3 matchups to rank
     '''
-    return matchup_dict["rate"]
+    count = len(raw_data)
+    ids = np.fromiter((matchup["hero_id"] for matchup in raw_data), dtype=np.int64, count=count)
+    games = np.fromiter((matchup["games_played"] for matchup in raw_data), dtype=np.float64, count=count)
+    wins = np.fromiter((matchup["wins"] for matchup in raw_data), dtype=np.float64, count=count)
+    #only count matchup with not less than 10 matches
+    mask = games >= 10
+    ids = ids[mask]
+    rates = wins[mask] / games[mask]
+    if len(rates) < 3:
+        return None
+    #partition out the 3 highest and 3 lowest rates, then order just those
+    best = np.argpartition(-rates, 2)[:3]
+    best = best[np.argsort(-rates[best], kind="stable")]
+    worst = np.argpartition(rates, 2)[:3]
+    worst = worst[np.argsort(rates[worst], kind="stable")]
+    extremes = []
+    for i in np.concatenate((best, worst)):
+        extremes.append(int(ids[i]))
+        extremes.append(float(rates[i]))
+    return extremes
 
 def Heroes_helper(hero_list):
     '''get hero id from API and match up data 
         return a Heros table entry tuples list
+        matchups of up to MATCHUP_FETCH_WORKERS heroes are fetched at once on the fetch loop
     
     Parameters
     ----------
@@ -1114,65 +3840,24 @@ def Heroes_helper(hero_list):
     '''
     hero_dict = get_hero_info_api()
     #link hero id to hero_list
-    entry_list = []
+    id_list = []
     for hero in hero_list:
         name = hero["name"]
-        img = hero["img"]
-        bio = hero["bio"]
         #check key
         if name not in hero_dict.keys():
-            hero_id = 0
+            id_list.append(0)
         else:
-            hero_id = hero_dict[name]["id"]
-        #get matchup data
-        category = f"heroes/{hero_id}/matchups"
-        raw_data = get_data(category, {})
+            id_list.append(hero_dict[name]["id"])
+    #get matchup data
+    categories = [f"heroes/{hero_id}/matchups" for hero_id in id_list]
+    raw_list = get_all_data(categories, MATCHUP_FETCH_WORKERS)
+    entry_list = []
+    for (hero, hero_id, raw_data) in zip(hero_list, id_list, raw_list):
+        extremes = matchup_extremes(raw_data)
         #if hero info not found in API, use NULLs 
-        if raw_data == []:
-            matchup1 = 0
-            rate1 = 0
-            matchup2 = 0
-            rate2 = 0
-            matchup3 = 0
-            rate3 = 0
-            matchup_1 = 0
-            rate_1 = 0
-            matchup_2 = 0
-            rate_2 = 0
-            matchup_3 = 0
-            rate_3 = 0
-            entry_list.append((hero_id, name, img, bio, matchup1, rate1, matchup2, rate2, matchup3, rate3, matchup_1, rate_1, matchup_2, rate_2, matchup_3, rate_3))
-            continue
-        rate_data = []
-        #calculate win rate
-        for matchup in raw_data:
-            item = {}
-            matchup_ct = matchup["games_played"]
-            #only count matchup with not less than 10 matches
-            if matchup_ct < 10:
-                continue
-            matchup_id = matchup["hero_id"]
-            matchup_win = matchup["wins"]
-            matchup_rate = matchup_win/matchup_ct
-            item["rate"] = matchup_rate
-            item["hero_id"] = matchup_id
-            rate_data.append(item)
-        #sort the matchup data
-        rate_data.sort(reverse = True, key = sort_helper)
-        matchup1 = rate_data[0]["hero_id"]
-        rate1 = rate_data[0]["rate"]
-        matchup2 = rate_data[1]["hero_id"]
-        rate2 = rate_data[1]["rate"]
-        matchup3 = rate_data[2]["hero_id"]
-        rate3 = rate_data[2]["rate"]
-        matchup_1 = rate_data[-1]["hero_id"]
-        rate_1 = rate_data[-1]["rate"]
-        matchup_2 = rate_data[-2]["hero_id"]
-        rate_2 = rate_data[-2]["rate"]
-        matchup_3 = rate_data[-3]["hero_id"]
-        rate_3 = rate_data[-3]["rate"]
-        #append to entry list
-        entry_list.append((hero_id, name, img, bio, matchup1, rate1, matchup2, rate2, matchup3, rate3, matchup_1, rate_1, matchup_2, rate_2, matchup_3, rate_3))
+        if extremes is None:
+            extremes = [0] * 12
+        entry_list.append(tuple([hero_id, hero["name"], hero["img"], hero["bio"]] + extremes))
     return entry_list
 
 def get_n_store_Heroes():
@@ -1192,17 +3877,331 @@ def get_n_store_Heroes():
     hero_list = get_hero_detail(hero_links)
     #link info with hero id from API and get matchup data
     entry_list = Heroes_helper(hero_list)
-    #store into DB
-    construct_DB_Heroes()
-    add_DB_Heroes(entry_list)
+    #store into the shadow table and swap it in
+    shadow = shadow_table("Heroes")
+    with bulk_load(shadow) as conn:
+        construct_DB_Heroes(conn, shadow)
+        add_DB_Heroes(entry_list, conn, shadow)
+    swap_DB_tables(["Heroes"])
+    load_hero_names(refresh=True)
+    prerender_matchup_plots()
+
+def diff_DB_table(conn, table, columns, key, rows):
+    '''write only the rows that differ from the stored ones,
+    rows are matched by their key columns and rows missing from the new data are deleted
+    
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        a writable connection inside a transaction
+    table: string
+        name of the table
+    columns: list
+        names of the columns the rows hold values for
+    key: list
+        names of the columns identifying a row
+    rows: list
+        the new table entries, values in the order of columns
+    
+    Returns
+    -------
+    int
+        number of inserted, updated and deleted rows
+    '''
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    key_list = ", ".join(f'"{column}"' for column in key)
+    #stage the new rows with the column types of the table, so values compare as stored
+    conn.execute('DROP TABLE IF EXISTS temp."refresh_staged"')
+    conn.execute(f'CREATE TEMP TABLE "refresh_staged" AS SELECT {column_list} FROM "{table}" WHERE 0')
+    placeholders = ", ".join("?" * len(columns))
+    conn.executemany(f'INSERT INTO temp."refresh_staged" VALUES ({placeholders})', rows)
+    #new or changed rows
+    changed = conn.execute(f'''
+        SELECT {column_list} FROM temp."refresh_staged"
+        EXCEPT
+        SELECT {column_list} FROM "{table}"
+    ''').fetchall()
+    key_index = [columns.index(column) for column in key]
+    stored_keys = set(conn.execute(f'SELECT {key_list} FROM "{table}"').fetchall())
+    updates = []
+    inserts = []
+    for row in changed:
+        row_key = tuple(row[i] for i in key_index)
+        if row_key in stored_keys:
+            updates.append(tuple(row) + row_key)
+        else:
+            inserts.append(row)
+    set_list = ", ".join(f'"{column}" = ?' for column in columns)
+    key_match = " AND ".join(f'"{column}" = ?' for column in key)
+    conn.executemany(f'UPDATE "{table}" SET {set_list} WHERE {key_match}', updates)
+    conn.executemany(f'INSERT INTO "{table}" ({column_list}) VALUES ({placeholders})', inserts)
+    deleted = conn.execute(f'''
+        DELETE FROM "{table}"
+        WHERE ({key_list}) NOT IN (SELECT {key_list} FROM temp."refresh_staged")
+    ''').rowcount
+    conn.execute('DROP TABLE temp."refresh_staged"')
+    return len(updates) + len(inserts) + deleted
+
+def write_DB_diff(table, columns, key, rows):
+    '''apply diff_DB_table to a live table in its own transaction
+    
+    Parameters
+    ----------
+    table: string
+        name of the table
+    columns: list
+        names of the columns the rows hold values for
+    key: list
+        names of the columns identifying a row
+    rows: list
+        the new table entries, values in the order of columns
+    
+    Returns
+    -------
+    int
+        number of inserted, updated and deleted rows
+    '''
+    with db_connection(readonly=False) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        changed = diff_DB_table(conn, table, columns, key, rows)
+        conn.commit()
+    print(f"Refreshed {table}, {changed} rows changed")
+    return changed
+
+def refresh_Heroes():
+    '''refetch hero data and write the changed Heroes rows
+    
+    Parameters
+    ----------
+    N/A
+    
+    Returns
+    -------
+    int
+        number of changed rows
+    '''
+    hero_list = get_hero_detail(get_hero_links())
+    entry_list = Heroes_helper(hero_list)
+    columns = [column for (_, column, *_) in DB_query('PRAGMA table_info("Heroes")')]
+    changed = write_DB_diff("Heroes", columns, ["Id"], entry_list)
+    if changed:
+        load_hero_names(refresh=True)
+        prerender_matchup_plots()
+    return changed
+
+def refresh_ProPlayers():
+    '''refetch pro players and write the changed ProPlayers rows,
+    players keep their Id so ActiveProPlayers links stay valid
+    
+    Parameters
+    ----------
+    N/A
+    
+    Returns
+    -------
+    int
+        number of changed rows
+    '''
+    #download first, rows are staged by diff_DB_table as the file is parsed
+    path = fetch_payload("ProPlayers", {})
+    rows = (ProPlayers_row(player_dict) for player_dict in iter_payload(path) if len(player_dict) != 0)
+    columns = [column for (_, column, *_) in DB_query('PRAGMA table_info("ProPlayers")')][1:]
+    changed = write_DB_diff("ProPlayers", columns, ["account_id"], rows)
+    if changed:
+        with db_connection(readonly=False) as conn:
+            index_pro_players(conn)
+            conn.commit()
+    return changed
+
+def refresh_ActiveProPlayers():
+    '''refetch active teams and write the changed ActiveProPlayers rows
+    
+    Parameters
+    ----------
+    N/A
+    
+    Returns
+    -------
+    int
+        number of changed rows
+    '''
+    rows = ActiveProPlayers_helper(get_active_teams())
+    columns = ["player_name", "team_name", "region", "ProPlayers_table_id"]
+    #an entry is its whole row, changes show up as a delete and an insert
+    changed = write_DB_diff("ActiveProPlayers", columns, columns, rows)
+    if changed:
+        rebuild_team_rosters()
+    return changed
+
+#datasets in refresh order, with the functions building them from scratch and refreshing them
+#and the other datasets their build rebuilds along
+DATASETS = [
+    ("Heroes", get_n_store_Heroes, refresh_Heroes, []),
+    ("ProPlayers", get_n_store_ProPlayers, refresh_ProPlayers, ["ActiveProPlayers"]),
+    ("ActiveProPlayers", get_n_store_ActiveProPlayers, refresh_ActiveProPlayers, []),
+]
+
+def refresh_due(name):
+    '''check whether a dataset is older than its REFRESH_INTERVALS
+    
+    Parameters
+    ----------
+    name: string
+        name of the dataset table
+    
+    Returns
+    -------
+    bool
+        True if the dataset was never refreshed or is due
+    '''
+    result = DB_query('SELECT refreshed_at FROM "DatasetRefresh" WHERE name = ?', (name,))
+    if result == []:
+        return True
+    return time.time() - result[0][0] >= REFRESH_INTERVALS[name]
+
+def record_refresh(name, changed):
+    '''store when a dataset was refreshed
+    
+    Parameters
+    ----------
+    name: string
+        name of the dataset table
+    changed: int
+        number of rows the refresh changed, -1 for a rebuild
+    
+    Returns
+    -------
+    N/A
+    '''
+    with db_connection(readonly=False) as conn:
+        conn.execute('INSERT OR REPLACE INTO "DatasetRefresh" VALUES (?, ?, ?)', (name, time.time(), changed))
+        conn.commit()
+
+def refresh_status():
+    '''last refresh of each dataset, for the stats page
+    
+    Parameters
+    ----------
+    N/A
+    
+    Returns
+    -------
+    dict
+        refreshed_at and changed rows under dataset names
+    '''
+    try:
+        result = DB_query('SELECT name, refreshed_at, changed FROM "DatasetRefresh"')
+    except sqlite3.OperationalError:
+        #no database file yet
+        return {}
+    return {name: {"refreshed_at": refreshed_at, "changed": changed} for (name, refreshed_at, changed) in result}
+
+def ingest_all():
+    '''build the missing Heroes, ProPlayers and ActiveProPlayers tables
+    and refresh the ones that are due, run in the background by start_ingestion
+    
+    Parameters
+    ----------
+    N/A
+    
+    Returns
+    -------
+    N/A
+    '''
+    with INGEST_LOCK:
+        INGEST_STATUS["state"] = "running"
+        INGEST_STATUS["started_at"] = time.time()
+    errors = []
+    for (name, build, refresh, built_along) in DATASETS:
+        #one failing source leaves the other datasets refreshing
+        try:
+            if not db_has_table(name):
+                build()
+                #a dataset rebuilt along is fresh too, it is not refreshed right after
+                for built in [name] + built_along:
+                    record_refresh(built, -1)
+            elif refresh_due(name):
+                record_refresh(name, refresh())
+        except Exception as e:
+            print(f"Refreshing {name} failed: {e}")
+            errors.append(f"{name}: {e}")
+    with INGEST_LOCK:
+        INGEST_STATUS["state"] = "failed" if errors else "done"
+        INGEST_STATUS["error"] = "; ".join(errors) if errors else None
+        INGEST_STATUS["finished_at"] = time.time()
+
+def refresh_scheduler():
+    '''run ingest_all every REFRESH_POLL seconds
+    
+    Parameters
+    ----------
+    N/A
+    
+    Returns
+    -------
+    N/A
+    '''
+    while True:
+        ingest_all()
+        time.sleep(REFRESH_POLL)
+
+def start_ingestion():
+    '''run refresh_scheduler in a background thread
+    
+    Parameters
+    ----------
+    N/A
+    
+    Returns
+    -------
+    threading.Thread
+        the ingestion thread
+    '''
+    thread = threading.Thread(target=refresh_scheduler, daemon=True)
+    thread.start()
+    return thread
+
+def db_has_table(table):
+    '''check whether DB holds a table
+    
+    Parameters
+    ----------
+    table: string
+        name of the table
+    
+    Returns
+    -------
+    bool
+        True if the table exists
+    '''
+    query = "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = ?"
+    try:
+        return DB_query(query, (table,))[0][0] == 1
+    except sqlite3.OperationalError:
+        #no database file yet
+        return False
+
+def db_ready():
+    '''check whether DB holds a snapshot of every ingested table
+    
+    Parameters
+    ----------
+    N/A
+    
+    Returns
+    -------
+    bool
+        True once Heroes, ProPlayers and ActiveProPlayers all exist
+    '''
+    return all(db_has_table(name) for (name, _, _, _) in DATASETS)
 
 if __name__ == "__main__":
     print('starting Flask app', app.name)
-    #get data
-    get_n_store_Heroes()
-    get_n_store_ProPlayers()
-    get_n_store_ActiveProPlayers()
+    #upgrade an existing database
+    migrate_DB()
+    #get missing data and refresh stale data in the background, the last good snapshot is served meanwhile
+    #with the debug reloader only the child process started by app.run serves
+    if not FLASK_DEBUG or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_ingestion()
     #run app
-    app.run(debug=True)
-    
-    
+    app.run(debug=FLASK_DEBUG)
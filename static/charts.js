@@ -0,0 +1,177 @@
+/* draw the kda and matchup charts from the series in data-chart,
+   used when CHART_MODE is "json" in final_project.py */
+(function () {
+    var font = "12px sans-serif";
+
+    function niceStep(max, count) {
+        /* integer tick step giving about count ticks up to max */
+        var step = Math.max(1, Math.ceil(max / count));
+        var scale = Math.pow(10, Math.floor(Math.log10(step)));
+        var steps = [1, 2, 5, 10];
+        for (var i = 0; i < steps.length; i++) {
+            if (steps[i] * scale >= step) {
+                return steps[i] * scale;
+            }
+        }
+        return step;
+    }
+
+    function drawMarker(ctx, shape, x, y) {
+        ctx.beginPath();
+        if (shape === "o") {
+            ctx.arc(x, y, 4, 0, 2 * Math.PI);
+            ctx.fill();
+        } else if (shape === "x") {
+            ctx.moveTo(x - 4, y - 4);
+            ctx.lineTo(x + 4, y + 4);
+            ctx.moveTo(x + 4, y - 4);
+            ctx.lineTo(x - 4, y + 4);
+            ctx.stroke();
+        } else {
+            ctx.moveTo(x, y - 5);
+            ctx.lineTo(x + 4, y);
+            ctx.lineTo(x, y + 5);
+            ctx.lineTo(x - 4, y);
+            ctx.closePath();
+            ctx.fill();
+        }
+    }
+
+    function drawKda(canvas, chart) {
+        /* kills, deaths and assists of recent matches as lines */
+        var ctx = canvas.getContext("2d");
+        var series = [
+            {label: "kill", values: chart.k, color: "red", marker: "o"},
+            {label: "death", values: chart.d, color: "blue", marker: "x"},
+            {label: "assist", values: chart.a, color: "green", marker: "d"}
+        ];
+        var left = 40, top = 10, right = canvas.width - 100, bottom = canvas.height - 20;
+        var count = chart.k.length;
+        var max = 1;
+        series.forEach(function (s) {
+            s.values.forEach(function (v) { max = Math.max(max, v); });
+        });
+        var step = niceStep(max, 5);
+        max = Math.ceil(max / step) * step;
+        function xAt(i) {
+            return count <= 1 ? (left + right) / 2 : left + i * (right - left) / (count - 1);
+        }
+        function yAt(v) {
+            return bottom - v * (bottom - top) / max;
+        }
+        ctx.clearRect(0, 0, canvas.width, canvas.height);
+        ctx.fillStyle = "white";
+        ctx.fillRect(left, top, right - left, bottom - top);
+        ctx.font = font;
+        //one vertical grid line per match
+        ctx.strokeStyle = "#b0b0b0";
+        ctx.lineWidth = 1;
+        for (var i = 0; i < count; i++) {
+            ctx.beginPath();
+            ctx.moveTo(xAt(i), top);
+            ctx.lineTo(xAt(i), bottom);
+            ctx.stroke();
+        }
+        //integer y ticks
+        ctx.fillStyle = "black";
+        ctx.textAlign = "right";
+        ctx.textBaseline = "middle";
+        for (var v = 0; v <= max; v += step) {
+            ctx.fillText(String(v), left - 6, yAt(v));
+        }
+        ctx.strokeStyle = "black";
+        ctx.strokeRect(left, top, right - left, bottom - top);
+        series.forEach(function (s) {
+            ctx.strokeStyle = s.color;
+            ctx.fillStyle = s.color;
+            ctx.lineWidth = 1.5;
+            ctx.beginPath();
+            s.values.forEach(function (v, i) {
+                if (i === 0) {
+                    ctx.moveTo(xAt(i), yAt(v));
+                } else {
+                    ctx.lineTo(xAt(i), yAt(v));
+                }
+            });
+            ctx.stroke();
+            s.values.forEach(function (v, i) {
+                drawMarker(ctx, s.marker, xAt(i), yAt(v));
+            });
+        });
+        //legend on the right
+        ctx.textAlign = "left";
+        series.forEach(function (s, i) {
+            var y = top + 10 + i * 18;
+            ctx.strokeStyle = s.color;
+            ctx.fillStyle = s.color;
+            ctx.beginPath();
+            ctx.moveTo(right + 10, y);
+            ctx.lineTo(right + 40, y);
+            ctx.stroke();
+            drawMarker(ctx, s.marker, right + 25, y);
+            ctx.fillStyle = "black";
+            ctx.fillText(s.label, right + 46, y);
+        });
+    }
+
+    function drawMatchup(canvas, chart) {
+        /* matchup win rate percentages as horizontal bars */
+        var ctx = canvas.getContext("2d");
+        var left = 110, top = 30, right = canvas.width - 15, bottom = canvas.height - 40;
+        var count = chart.names.length;
+        var slot = (bottom - top) / Math.max(count, 1);
+        function xAt(rate) {
+            return left + rate * (right - left) / 100;
+        }
+        ctx.clearRect(0, 0, canvas.width, canvas.height);
+        ctx.fillStyle = "white";
+        ctx.fillRect(left, top, right - left, bottom - top);
+        ctx.font = font;
+        ctx.fillStyle = "black";
+        ctx.textAlign = "center";
+        ctx.textBaseline = "middle";
+        ctx.fillText("3 Worst Against Heroes and 3 Best Against Heroes", canvas.width / 2, top / 2);
+        ctx.fillText("Win rate percentage", (left + right) / 2, canvas.height - 10);
+        //dashed grid every 20 percent
+        ctx.strokeStyle = "rgba(128, 128, 128, 0.25)";
+        ctx.setLineDash([4, 4]);
+        for (var r = 0; r <= 100; r += 20) {
+            ctx.beginPath();
+            ctx.moveTo(xAt(r), top);
+            ctx.lineTo(xAt(r), bottom);
+            ctx.stroke();
+            ctx.fillText(String(r), xAt(r), bottom + 12);
+        }
+        ctx.setLineDash([]);
+        //solid line at the median
+        ctx.beginPath();
+        ctx.moveTo(xAt(50), top);
+        ctx.lineTo(xAt(50), bottom);
+        ctx.stroke();
+        //bars from the bottom up, like the server side plot
+        for (var i = 0; i < count; i++) {
+            var rate = chart.rates[i];
+            var y = bottom - (i + 0.5) * slot;
+            ctx.fillStyle = "#1f77b4";
+            ctx.fillRect(left, y - slot / 4, xAt(rate) - left, slot / 2);
+            ctx.fillStyle = "black";
+            ctx.textAlign = "right";
+            ctx.fillText(chart.names[i], left - 6, y);
+            ctx.font = "bold " + font;
+            ctx.fillText(String(rate), xAt(rate) - 5, y);
+            ctx.font = font;
+        }
+        ctx.strokeStyle = "black";
+        ctx.strokeRect(left, top, right - left, bottom - top);
+    }
+
+    var canvases = document.querySelectorAll("canvas.chart");
+    for (var i = 0; i < canvases.length; i++) {
+        var chart = JSON.parse(canvases[i].getAttribute("data-chart"));
+        if (chart.kind === "kda") {
+            drawKda(canvases[i], chart);
+        } else if (chart.kind === "matchup") {
+            drawMatchup(canvases[i], chart);
+        }
+    }
+})();